@@ -1,7 +1,9 @@
-from aiohttp_requests import requests
-from typing import Optional
+import aiohttp
+import time
+import traceback
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set
 from dotenv import load_dotenv
-import json
 import asyncio
 import os
 
@@ -9,6 +11,26 @@ load_dotenv()
 
 APIKEY = os.getenv('APIKEY')
 
+# Tenor accepts up to 50 ids per request
+MAX_IDS = 50
+# gif urls don't change, but gifs can be removed
+TTL = 60 * 60 * 24
+# ids that Tenor doesn't know about
+MISSING_TTL = 60 * 60
+# lookups that failed (timeout, 5xx...) are retried after this
+ERROR_TTL = 60
+MAX_SIZE = 10000
+TIMEOUT = aiohttp.ClientTimeout(total=3, connect=1)
+
+# {gifid: (expires_at, url)}
+_cache: OrderedDict = OrderedDict()
+# {gifid: future}, for lookups that are waiting on a request
+_pending: Dict[str, asyncio.Future] = {}
+_session: Optional[aiohttp.ClientSession] = None
+# lookups in progress; the event loop only keeps weak references
+# to tasks
+_tasks: Set[asyncio.Task] = set()
+
 
 def _simplify(
     url: str
@@ -28,19 +50,124 @@ def get_gif_id(
     return gif_id
 
 
+def _session_get() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(timeout=TIMEOUT)
+    return _session
+
+
+async def close() -> None:
+    if _session is not None and not _session.closed:
+        await _session.close()
+
+
+def _cached(
+    gifid: str
+) -> tuple:
+    """Returns (found, url)"""
+    entry = _cache.get(gifid)
+    if entry is None:
+        return False, None
+    expires, url = entry
+    if expires < time.monotonic():
+        del _cache[gifid]
+        return False, None
+    _cache.move_to_end(gifid)
+    return True, url
+
+
+def _store(
+    gifid: str,
+    url: Optional[str],
+    ttl: float
+) -> None:
+    _cache[gifid] = (time.monotonic() + ttl, url)
+    _cache.move_to_end(gifid)
+    while len(_cache) > MAX_SIZE:
+        _cache.popitem(last=False)
+
+
+async def _fetch(
+    gifids: list
+) -> None:
+    """Looks up `gifids` in one request and resolves their
+    pending futures. Failures resolve to None."""
+    results = {}
+    ttl = ERROR_TTL
+    try:
+        async with _session_get().get(
+            'https://api.tenor.com/v1/gifs',
+            params={'ids': ','.join(gifids), 'key': APIKEY}
+        ) as r:
+            if r.status == 200:
+                gifs = await r.json(content_type=None)
+                for gif in gifs['results']:
+                    # load the GIFs using the urls for the smaller
+                    # GIF sizes
+                    results[str(gif['id'])] = gif['media'][0]['gif']['url']
+                ttl = MISSING_TTL
+    except (aiohttp.ClientError, asyncio.TimeoutError, KeyError,
+            IndexError, ValueError):
+        pass
+    finally:
+        # resolve every future, even if something unexpected went
+        # wrong, so that nobody waits on this lookup forever
+        for gifid in gifids:
+            url = results.get(gifid)
+            _store(gifid, url, TTL if url is not None else ttl)
+            future = _pending.pop(gifid, None)
+            if future is not None and not future.done():
+                future.set_result(url)
+
+
+def _done(
+    task: asyncio.Task
+) -> None:
+    _tasks.discard(task)
+    if task.cancelled():
+        return
+    e = task.exception()
+    if e is not None:
+        traceback.print_exception(type(e), e, e.__traceback__)
+
+
+async def get_gif_urls(
+    gifids: Iterable[str]
+) -> Dict[str, Optional[str]]:
+    """Returns {gifid: url} for each id, with None for gifs that
+    couldn't be found. Ids that aren't cached or already being
+    looked up are fetched in batches of MAX_IDS."""
+    result = {}
+    waiting = {}
+    to_fetch = []
+    loop = asyncio.get_running_loop()
+    for gifid in dict.fromkeys(gifids):
+        found, url = _cached(gifid)
+        if found:
+            result[gifid] = url
+            continue
+        if gifid not in _pending:
+            _pending[gifid] = loop.create_future()
+            to_fetch.append(gifid)
+        waiting[gifid] = _pending[gifid]
+
+    for x in range(0, len(to_fetch), MAX_IDS):
+        task = asyncio.create_task(_fetch(to_fetch[x:x+MAX_IDS]))
+        _tasks.add(task)
+        task.add_done_callback(_done)
+
+    for gifid, future in waiting.items():
+        # shield so that a cancelled caller doesn't cancel the
+        # lookup for everyone else waiting on it
+        result[gifid] = await asyncio.shield(future)
+    return result
+
+
 async def get_gif_url(
     gifid: str
 ) -> Optional[str]:
-    r = await requests.get(
-        f"https://api.tenor.com/v1/gifs?ids={gifid}&key={APIKEY}"
-    )
-
-    if r.status == 200:
-        # load the GIFs using the urls for the smaller GIF sizes
-        gifs = json.loads(await r.text())
-        return gifs['results'][0]['media'][0]['gif']['url']
-    else:
-        return None
+    return (await get_gif_urls([gifid]))[gifid]
 
 
 if __name__ == '__main__':
@@ -52,3 +179,4 @@ if __name__ == '__main__':
     else:
         gif_url = loop.run_until_complete(get_gif_url(gifid))
         print(f"GIF URL: {gif_url}")
+    loop.run_until_complete(close())
@@ -5,6 +5,7 @@ import os
 import dotenv
 import functions
 import pretty_help
+from api import tenor
 from discord.ext import commands
 from asyncio import Lock
 
@@ -27,7 +28,12 @@ To get started, run the "setup" command.
 If you need help, just mention me for a link to the support server.
 """
 
-db = Database()
+# settings added after bot_config.py.example was first copied fall
+# back to the example's defaults
+db = Database(
+    pool_min_size=getattr(bot_config, 'DB_POOL_MIN_SIZE', 2),
+    pool_max_size=getattr(bot_config, 'DB_POOL_MAX_SIZE', 10)
+)
 
 emojis = bot_config.PAGINATOR_EMOJIS
 navigation = pretty_help.Navigation(
@@ -133,4 +139,7 @@ if __name__ == '__main__':
         print("Logging out")
         loop.run_until_complete(bot.logout())
         loop.run_until_complete(web_server.close())
+        loop.run_until_complete(db.close())
+        loop.run_until_complete(tenor.close())
+        loop.run_until_complete(functions.attachment_spool.close())
         exit(1)
@@ -53,9 +53,10 @@ async def clean_starboards(
         async with conn.transaction():
             await conn.execute(
                 """DELETE FROM starboards
-                WHERE id=ANY($1::numeric[])""",
+                WHERE id=ANY($1::bigint[])""",
                 to_delete
             )
+    bot.db.config_cache.invalidate(guild.id)
 
     return len(to_delete)
 
@@ -85,9 +86,10 @@ async def clean_aschannels(
         async with conn.transaction():
             await conn.execute(
                 """DELETE FROM aschannels
-                WHERE id=ANY($1::numeric[])""",
+                WHERE id=ANY($1::bigint[])""",
                 to_delete
             )
+    bot.db.config_cache.invalidate(guild.id)
 
     return len(to_delete)
 
@@ -108,7 +110,7 @@ async def clean_sbemojis(
             ]
             sbemojis = await conn.fetch(
                 """SELECT * FROM sbemojis
-                WHERE starboard_id=ANY($1::numeric[])""",
+                WHERE starboard_id=ANY($1::bigint[])""",
                 starboard_ids
             )
 
@@ -130,6 +132,7 @@ async def clean_sbemojis(
                 WHERE name=ANY($1::text[])""",
                 to_delete
             )
+    bot.db.config_cache.invalidate(guild.id)
 
     return len(to_delete)
 
@@ -150,7 +153,7 @@ async def clean_asemojis(
             ]
             asemojis = await conn.fetch(
                 """SELECT * FROM asemojis
-                WHERE aschannel_id=ANY($1::numeric[])""",
+                WHERE aschannel_id=ANY($1::bigint[])""",
                 aschannels_ids
             )
 
@@ -172,6 +175,7 @@ async def clean_asemojis(
                 WHERE name=ANY($1::text[])""",
                 to_delete
             )
+    bot.db.config_cache.invalidate(guild.id)
 
     return len(to_delete)
 
@@ -201,7 +205,7 @@ async def clean_xproles(
         async with conn.transaction():
             await conn.execute(
                 """DELETE FROM xproles
-                WHERE id=ANY($1::numeric[])""",
+                WHERE id=ANY($1::bigint[])""",
                 to_delete
             )
 
@@ -233,7 +237,7 @@ async def clean_posroles(
         async with conn.transaction():
             await conn.execute(
                 """DELETE FROM posroles
-                WHERE id=ANY($1::numeric[])""",
+                WHERE id=ANY($1::bigint[])""",
                 to_delete
             )
 
@@ -265,9 +269,10 @@ async def clean_channelbl(
         async with conn.transaction():
             await conn.execute(
                 """DELETE FROM channelbl
-                WHERE channel_id=ANY($1::numeric[])""",
+                WHERE channel_id=ANY($1::bigint[])""",
                 to_delete
             )
+    bot.db.config_cache.invalidate(guild.id)
 
     return len(to_delete)
 
@@ -297,8 +302,9 @@ async def clean_rolebl(
         async with conn.transaction():
             await conn.execute(
                 """DELETE FROM rolebl
-                WHERE role_id=ANY($1::numeric[])""",
+                WHERE role_id=ANY($1::bigint[])""",
                 to_delete
             )
+    bot.db.config_cache.invalidate(guild.id)
 
     return len(to_delete)
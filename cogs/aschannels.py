@@ -1,37 +1,14 @@
 # aschannels stand for auto-star channels
 import datetime
-from typing import List, Union
+from typing import Union
 
 import discord
-from discord import utils
 from discord.ext import commands
 
 import bot_config
 import functions
 import settings
-
-
-async def converted_emojis(
-    emojis: List[dict],
-    guild: discord.Guild
-) -> List[discord.Emoji]:
-    all_emojis = []
-
-    for emoji in emojis:
-        emoji_name = emoji['name']
-        try:
-            emoji_id = int(emoji_name)
-        except ValueError:
-            emoji_id = None
-
-        if emoji_id is not None:
-            emoji_obj = utils.get(guild.emojis, id=emoji_id)
-            if emoji_obj is not None:
-                all_emojis.append(emoji_obj)
-        else:
-            all_emojis.append(emoji_name)
-
-    return all_emojis
+from cogs import starboard
 
 
 class AutoStarChannels(commands.Cog):
@@ -63,24 +40,14 @@ class AutoStarChannels(commands.Cog):
         )
         if retry_after:
             return
-        get_emojis = \
-            """SELECT * FROM asemojis WHERE aschannel_id=$1"""
-
         channel = message.channel
         guild = message.guild
-        conn = self.bot.db.conn
 
         valid = True
         reason = None
 
-        check_aschannel = \
-            """SELECT * FROM aschannels WHERE ID=$1"""
-
-        async with self.bot.db.lock:
-            async with self.bot.db.conn.transaction():
-                sasc = await self.bot.db.conn.fetchrow(
-                    check_aschannel, channel.id
-                )
+        config = await self.bot.db.config_cache.get(guild.id)
+        sasc = config.aschannels.get(channel.id)
 
         if sasc is None or sasc['locked']:
             return False
@@ -111,19 +78,12 @@ class AutoStarChannels(commands.Cog):
         elif not valid:
             return True
 
-        async with self.bot.db.lock:
-            async with conn.transaction():
-                s_emojis = await conn.fetch(
-                    get_emojis, channel.id
-                )
-
-        asemojis = await converted_emojis(s_emojis, guild)
-
-        for e in asemojis:
-            try:
-                await message.add_reaction(e)
-            except Exception as e:
-                print(f"ASEmoji Error: {type(e)} {e}")
+        asemojis = config.asemojis.get(channel.id, [])
+        starboard.outbound_scheduler.seed_reactions(
+            message, functions.resolve_emojis(
+                guild, [e['name'] for e in asemojis]
+            )
+        )
 
         return True
 
@@ -77,8 +77,7 @@ async def handle_reaction(
 
     # leveled_up = False
 
-    async with bot.db.lock:
-        conn = await bot.db.connect()
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             sql_reacter = await conn.fetchrow(get_member, reacter_id, guild_id)
             given = sql_reacter['given']+points
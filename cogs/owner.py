@@ -1,6 +1,7 @@
 import ast
 import time
 from subprocess import PIPE, run
+from typing import List
 
 import discord
 from asyncpg.exceptions._base import InterfaceError
@@ -9,8 +10,9 @@ from discord.ext import commands, tasks
 import bot_config
 import checks
 import functions
+from cogs import starboard
 from cogs.stats import post_all
-from database.database import Database
+from database.database import Database, SqlStats
 from paginators import disputils
 
 
@@ -39,8 +41,8 @@ class Owner(commands.Cog):
 
     @tasks.loop(minutes=5)
     async def dump_sqlruntimes(self) -> None:
-        async with self.bot.db.lock:
-            await self.bot.db.conn.dump()
+        async with self.bot.db.acquire() as conn:
+            await conn.dump()
 
     def insert_returns(
         self,
@@ -125,10 +127,112 @@ class Owner(commands.Cog):
         self,
         ctx: commands.Context
     ) -> None:
-        cache = self.bot.db.cache
-        cache._messages = {}
+        self.bot.db.cache.clear()
         await ctx.send("Cleared message cache for all servers.")
 
+    @commands.command(
+        name='cacheStats', aliases=['cs'],
+        brief='View message cache statistics',
+        description='View message cache statistics'
+    )
+    @checks.is_owner()
+    async def cache_stats(
+        self,
+        ctx: commands.Context
+    ) -> None:
+        stats = self.bot.db.cache.stats()
+        embed = discord.Embed(
+            title='Message Cache',
+            description=(
+                f"**Messages:** {stats['size']}/{stats['max_size']}\n"
+                f"**Size:** {round(stats['bytes']/1024/1024, 2)}/"
+                f"{round(stats['max_bytes']/1024/1024, 2)} MB\n"
+                f"**Guilds:** {stats['guilds']}\n"
+                f"**Hits:** {stats['hits']}\n"
+                f"**Misses:** {stats['misses']}\n"
+                f"**Hit Rate:** {round(stats['hit_rate']*100, 2)}%\n"
+                f"**Evictions:** {stats['evictions']}\n"
+                f"**Expirations:** {stats['expirations']}"
+            ),
+            color=bot_config.COLOR
+        )
+        embeds = self.bot.db.embed_cache.stats()
+        embed.add_field(
+            name='Embed Cache',
+            value=(
+                f"**Embeds:** {embeds['size']}/{embeds['max_size']}\n"
+                f"**Hits:** {embeds['hits']}\n"
+                f"**Misses:** {embeds['misses']}\n"
+                f"**Hit Rate:** {round(embeds['hit_rate']*100, 2)}%\n"
+                f"**Evictions:** {embeds['evictions']}\n"
+                f"**Invalidations:** {embeds['invalidations']}"
+            )
+        )
+        files = functions.attachment_spool.stats()
+        embed.add_field(
+            name='Attachment Spool',
+            value=(
+                f"**Files:** {files['files']}\n"
+                f"**Size:** {round(files['size']/1024/1024, 2)}/"
+                f"{round(files['max_size']/1024/1024, 2)} MB\n"
+                f"**Hits:** {files['hits']}\n"
+                f"**Downloads:** {files['downloads']}\n"
+                f"**Linked Instead:** {files['skipped']}\n"
+                f"**Failed:** {files['failed']}"
+            )
+        )
+        await ctx.send(embed=embed)
+
+    @commands.command(
+        name='workerStats', aliases=['ws'],
+        brief='View reaction worker queues',
+        description='View reaction worker queues'
+    )
+    @checks.is_owner()
+    async def worker_stats(
+        self,
+        ctx: commands.Context
+    ) -> None:
+        string = ''
+        for x, s in enumerate(starboard.reaction_workers.stats()):
+            avg_wait = ms(s['avg_wait']) if s['avg_wait'] is not None \
+                else '-'
+            avg_run = ms(s['avg_run']) if s['avg_run'] is not None else '-'
+            string += (
+                f"**{x}:** {s['depth']} queued | {s['processed']} done | "
+                f"{s['errors']} errors\n"
+                f"wait {avg_wait} ms avg, {ms(s['max_wait'])} ms max | "
+                f"run {avg_run} ms avg, {ms(s['max_run'])} ms max\n"
+            )
+        shed = starboard.reaction_workers.shed
+        string += (
+            f"\n**Busy:** {starboard.reaction_workers.busy}\n"
+            f"**Shed:** {shed['full']} full, {shed['duplicate']} duplicate\n"
+            f"**Deferred:** {shed['deferred']} "
+            f"({shed['coalesced']} coalesced, "
+            f"{shed['deferred_dropped']} dropped)"
+        )
+        out = starboard.outbound_scheduler.stats()
+        sent = ', '.join(f"{v} {k}" for k, v in out['sent'].items()) or '0'
+        failed = ', '.join(
+            f"{v} {route} {name}"
+            for (route, name), v in out['failures'].items()
+        ) or '0'
+        string += (
+            f"\n\n**Outbound:** {out['queued']} queued in "
+            f"{out['channels']} channels\n"
+            f"**Sent:** {sent}\n"
+            f"**Failed:** {failed}\n"
+            f"**Edits:** {out['coalesced']} coalesced, "
+            f"{out['cancelled']} cancelled"
+        )
+        embed = discord.Embed(
+            title='Reaction Workers',
+            description=string,
+            color=bot_config.COLOR
+        )
+        await ctx.send(embed=embed)
+
     @commands.command(
         name='postGuildCount', aliases=['pgc'],
         brief='Manually post the guild count to bot lists',
@@ -192,6 +296,110 @@ class Owner(commands.Cog):
                 await ctx.send(f"Query {x} took {round(r*1000, 2)} ms")
             await ctx.send(result[0:500])
 
+    @commands.command(
+        name='benchids',
+        brief='Compare numeric and bigint ids on the reaction hot path',
+        description='Compare numeric and bigint ids on the reaction hot path',
+        hidden=True
+    )
+    @checks.is_owner()
+    async def bench_snowflake_types(
+        self,
+        ctx: commands.Context,
+        rows: int = 100000,
+        runs: int = 200
+    ) -> None:
+        """Copies a sample of reactions and messages into temporary
+        numeric and bigint tables, indexes both the same way and
+        times the hot path lookups against each. Everything happens
+        in a transaction that is rolled back."""
+        if ctx.message.author.id not in bot_config.RUN_SQL:
+            return
+        copy_reactions = \
+            """CREATE TEMP TABLE bench_reactions_{0} AS
+            SELECT guild_id::{0} AS guild_id, user_id::{0} AS user_id,
+            message_id::{0} AS message_id, name
+            FROM reactions LIMIT {1}"""
+        copy_messages = \
+            """CREATE TEMP TABLE bench_messages_{0} AS
+            SELECT id::{0} AS id, orig_message_id::{0} AS orig_message_id,
+            channel_id::{0} AS channel_id, points
+            FROM messages LIMIT {1}"""
+        create_indexes = \
+            """CREATE INDEX ON bench_reactions_{0} (message_id);
+            CREATE INDEX ON bench_messages_{0} (id);
+            CREATE INDEX ON bench_messages_{0} (orig_message_id);
+            ANALYZE bench_reactions_{0};
+            ANALYZE bench_messages_{0}"""
+        get_sample = \
+            """SELECT DISTINCT message_id FROM bench_reactions_bigint
+            LIMIT 100"""
+        get_index_size = \
+            """SELECT pg_relation_size(
+                'bench_reactions_{0}_message_id_idx'
+            )"""
+        queries = {
+            'reactors': """SELECT DISTINCT user_id
+                FROM bench_reactions_{0} WHERE message_id=$1""",
+            'message': """SELECT * FROM bench_messages_{0} WHERE id=$1""",
+            'copies': """SELECT id, channel_id, points
+                FROM bench_messages_{0} WHERE orig_message_id=$1"""
+        }
+        types = ['numeric', 'bigint']
+
+        results = {}
+        index_sizes = {}
+        conn = self.bot.db.conn.realcon
+        async with ctx.typing():
+            try:
+                async with self.bot.db.lock:
+                    async with conn.transaction():
+                        for t in types:
+                            await conn.execute(copy_reactions.format(t, rows))
+                            await conn.execute(copy_messages.format(t, rows))
+                            await conn.execute(create_indexes.format(t))
+                            index_sizes[t] = await conn.fetchval(
+                                get_index_size.format(t)
+                            )
+                        sample = [
+                            r['message_id'] for r in
+                            await conn.fetch(get_sample)
+                        ]
+                        if len(sample) == 0:
+                            raise Exception("Rollback")
+                        for name, sql in queries.items():
+                            for t in types:
+                                stmt = await conn.prepare(sql.format(t))
+                                start = time.perf_counter()
+                                for x in range(runs):
+                                    await stmt.fetch(sample[x % len(sample)])
+                                results[(name, t)] = \
+                                    (time.perf_counter() - start) / runs
+                        raise Exception("Rollback")
+            except (Exception, InterfaceError):
+                pass
+
+        if len(results) != len(queries) * len(types):
+            await ctx.send("There isn't enough data to run the benchmark.")
+            return
+
+        string = f"**{runs} runs each**\n"
+        for name in queries:
+            before = results[(name, 'numeric')]
+            after = results[(name, 'bigint')]
+            string += (
+                f"{name}: {ms(before)} ms -> {ms(after)} ms "
+                f"({round(before/after, 2)}x)\n"
+            )
+        conversion = self.bot.db.snowflakes
+        string += (
+            f"reactions(message_id) index: {index_sizes['numeric']} -> "
+            f"{index_sizes['bigint']} bytes\n"
+            f"Conversion: {conversion.stage} "
+            f"({conversion.backfilled} rows backfilled)"
+        )
+        await ctx.send(string)
+
     @commands.command(name='sql', hidden=True)
     async def get_sql_stats(
         self,
@@ -221,16 +429,23 @@ class Owner(commands.Cog):
             async with self.bot.db.conn.transaction():
                 r = await conn.fetch(get_results)
                 sorted_rows = sorted(
-                    [(d['sql'], d['count'], d['time']) for d in r],
+                    [
+                        (d['sql'], d['count'], d['time'], d['buckets'])
+                        for d in r
+                    ],
                     key=sorter, reverse=True
                 )
 
         p = commands.Paginator(prefix='', suffix='', max_size=1000)
         embeds = []
         for sr in sorted_rows:
+            p50, p95, p99 = [
+                ms(SqlStats.percentile(sr[3], q)) for q in (0.5, 0.95, 0.99)
+            ]
             p.add_line(
                 f"```{sr[0]}```**{sr[1]} | {round(sr[2], 5)} seconds "
-                f"| {ms(sr[2]/sr[1])} ms**"
+                f"| {ms(sr[2]/sr[1])} ms**\n"
+                f"p50 <= {p50} ms | p95 <= {p95} ms | p99 <= {p99} ms"
             )
 
         for page in p.pages:
@@ -243,6 +458,74 @@ class Owner(commands.Cog):
         ep = disputils.EmbedPaginator(self.bot, embeds)
         await ep.run([ctx.message.author], ctx.channel)
 
+    @commands.command(name='indexAdvisor', aliases=['ia'], hidden=True)
+    async def index_advisor(
+        self,
+        ctx: commands.Context,
+        top: int = 25
+    ) -> None:
+        """Looks at the statements that took the most total time
+        according to sqlruntimes, and flags the ones whose generic
+        plan scans a table sequentially."""
+        if ctx.message.author.id not in bot_config.RUN_SQL:
+            return
+        get_hot_statements = \
+            """SELECT * FROM sqlruntimes
+            ORDER BY time DESC LIMIT $1"""
+        force_generic_plan = \
+            """SET LOCAL plan_cache_mode = force_generic_plan"""
+
+        def seq_scans(plan: dict) -> List[str]:
+            found = []
+            if plan.get('Node Type') == 'Seq Scan':
+                found.append(plan.get('Relation Name'))
+            for child in plan.get('Plans', []):
+                found += seq_scans(child)
+            return found
+
+        flagged = []
+        conn = self.bot.db.conn.realcon
+        async with ctx.typing():
+            async with self.bot.db.lock:
+                statements = await conn.fetch(get_hot_statements, top)
+                for s in statements:
+                    # parameters stay unknown with a generic plan,
+                    # which is what a prepared statement will use
+                    try:
+                        async with conn.transaction():
+                            await conn.execute(force_generic_plan)
+                            stmt = await conn.prepare(s['sql'])
+                            args = [None] * len(stmt.get_parameters())
+                            plan = await stmt.explain(*args)
+                    except Exception:
+                        # DDL, multiple statements and so on
+                        continue
+                    tables = seq_scans(plan[0]['Plan'])
+                    if tables:
+                        flagged.append((s, sorted(set(tables))))
+
+        if len(flagged) == 0:
+            await ctx.send(
+                f"None of the top {top} statements scan a table "
+                "sequentially."
+            )
+            return
+
+        p = commands.Paginator(prefix='', suffix='', max_size=1000)
+        for s, tables in flagged:
+            p.add_line(
+                f"```{s['sql']}```**{s['count']} | "
+                f"{round(s['time'], 5)} seconds**\n"
+                f"Sequential scan on: {', '.join(tables)}"
+            )
+
+        embeds = [
+            discord.Embed(title='Index Advisor', description=page)
+            for page in p.pages
+        ]
+        ep = disputils.EmbedPaginator(self.bot, embeds)
+        await ep.run([ctx.message.author], ctx.channel)
+
     @commands.command(name='clearsql')
     async def clear_sql_stats(
         self,
@@ -266,8 +549,8 @@ class Owner(commands.Cog):
     ) -> None:
         if ctx.message.author.id not in bot_config.RUN_SQL:
             return
-        async with self.bot.db.lock:
-            await self.bot.db.conn.dump()
+        async with self.bot.db.acquire() as conn:
+            await conn.dump()
 
         await ctx.send("Done")
 
@@ -286,7 +569,7 @@ class Owner(commands.Cog):
             """SELECT * FROM starboards"""
         clean_sb_messages = \
             """DELETE FROM messages
-            WHERE channel_id!=ALL($1::numeric[])
+            WHERE channel_id!=ALL($1::bigint[])
             AND is_orig=False"""
 
         await ctx.send("Removing messages...")
@@ -297,6 +580,8 @@ class Owner(commands.Cog):
                 )
                 sids = [s['id'] for s in starboards]
                 await conn.execute(clean_sb_messages, sids)
+        self.bot.db.message_links.clear()
+        self.bot.db.embed_cache.clear()
 
         await ctx.send("Finished cleaning")
 
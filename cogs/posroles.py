@@ -35,7 +35,7 @@ async def get_role_by_xp(
     get_lowest_xp = \
         """SELECT * FROM members
         WHERE guild_id=$1
-        AND user_id=ANY($2::numeric[])
+        AND user_id=ANY($2::bigint[])
         ORDER BY xp ASC
         LIMIT 1"""
 
@@ -1,3 +1,4 @@
+from functools import partial
 from typing import Optional
 
 import discord
@@ -25,9 +26,7 @@ async def is_qa_on(
         """SELECT is_qa_on FROM guilds
         WHERE id=$1"""
 
-    conn = bot.db.conn
-
-    async with bot.db.lock:
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             is_on = await conn.fetchval(
                 get_val, guild_id
@@ -40,8 +39,7 @@ async def is_orig(
     bot: commands.Bot,
     mid: int
 ) -> bool:
-    conn = bot.db.conn
-    async with bot.db.lock:
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             is_orig: bool = await conn.fetchval(
                 """SELECT is_orig FROM messages
@@ -77,10 +75,8 @@ async def toggle_setting(
     if guild is None:
         return
 
-    conn = bot.db.conn
-
-    async with bot.db.lock:
-        async with bot.db.conn.transaction():
+    async with bot.db.acquire() as conn:
+        async with conn.transaction():
             mid, _cid = await functions.orig_message_id(
                 bot.db, conn, message_id
             )
@@ -115,7 +111,57 @@ async def toggle_setting(
         return
 
     await starboard.handle_starboards(
-        bot.db, bot, mid, channel, message, guild
+        bot.db, bot, mid, channel, message, guild, recount=True
+    )
+
+
+async def handle_quick_action(
+    bot: commands.Bot,
+    payload: discord.RawReactionActionEvent,
+    action: str
+) -> None:
+    if not await is_qa_on(
+        bot, payload.guild_id
+    ):
+        return
+    elif await is_orig(
+        bot, payload.message_id
+    ):
+        return
+    elif await functions.is_starboard_emoji(
+        bot.db, payload.guild_id,
+        str(payload.emoji.id) if payload.emoji.id is not None
+        else payload.emoji.name
+    ):
+        return
+
+    bucket: cooldowns.Cooldown = qa_cooldown.get_bucket(payload.member.id)
+    retry_after = bucket.update_rate_limit()
+    if retry_after is not None:
+        return
+
+    guild = bot.get_guild(payload.guild_id)
+    channel = guild.get_channel(payload.channel_id)
+    if channel is None:
+        return
+    try:
+        message = await functions.fetch(
+            bot, payload.message_id, channel
+        )
+    except (discord.Forbidden, discord.NotFound):
+        return
+
+    try:
+        await message.remove_reaction(
+            payload.emoji.name, payload.member
+        )
+    except discord.Forbidden:
+        pass
+
+    await toggle_setting(
+        bot, payload.message_id,
+        payload.channel_id, payload.guild_id,
+        action
     )
 
 
@@ -141,47 +187,13 @@ class QuickActions(commands.Cog):
 
         if action is None:
             return
-        elif not await is_qa_on(
-            self.bot, payload.guild_id
-        ):
-            return
-        elif await is_orig(
-            self.bot, payload.message_id
-        ):
-            return
-        elif await functions.is_starboard_emoji(
-            self.bot.db, payload.guild_id,
-            payload.emoji
-        ):
-            return
-
-        bucket: cooldowns.Cooldown = qa_cooldown.get_bucket(payload.member.id)
-        retry_after = bucket.update_rate_limit()
-        if retry_after is not None:
-            return
-
-        guild = self.bot.get_guild(payload.guild_id)
-        channel = guild.get_channel(payload.channel_id)
-        if channel is None:
-            return
-        try:
-            message = await functions.fetch(
-                self.bot, payload.message_id, channel
-            )
-        except (discord.Forbidden, discord.NotFound):
-            return
-
-        try:
-            await message.remove_reaction(
-                payload.emoji.name, payload.member
-            )
-        except discord.Forbidden:
-            pass
 
-        await toggle_setting(
-            self.bot, payload.message_id,
-            payload.channel_id, payload.guild_id,
-            action
+        # same worker as the starboard's own reaction handling,
+        # so both see the reactions on a message in order
+        key = await starboard.reaction_key(self.bot.db, payload.message_id)
+        starboard.reaction_workers.submit(
+            key,
+            partial(handle_quick_action, self.bot, payload, action)
         )
 
     @commands.command(
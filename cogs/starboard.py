@@ -1,5 +1,8 @@
+import asyncio
 import random
-from typing import List, Optional, Union
+import traceback
+from functools import partial
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
 
 import asyncpg
 import discord
@@ -7,16 +10,63 @@ from discord import utils
 from discord.ext import commands, flags
 
 import bot_config
-import cooldowns
+import debounce
 import functions
+import outbound
 import settings
+import workers
 from cogs import levels
 from database.database import Database
 from settings import change_starboard_settings
 
-edit_message_cooldown = cooldowns.CooldownMapping.from_cooldown(
-    3, 5
+# reactions are written to the database right away, but the
+# starboard recount/edit for a message runs at most once per window
+update_debouncer = debounce.Debouncer(2)
+# raw reaction events are handled here, keyed by message id so that
+# the reactions on one message are processed in order
+reaction_workers = workers.WorkerPool(
+    getattr(bot_config, 'REACTION_WORKERS', 8),
+    max_queued=getattr(bot_config, 'REACTION_QUEUE_SIZE', 500),
+    busy_depth=getattr(bot_config, 'REACTION_BUSY_DEPTH', 100)
 )
+SHED_POLICIES = frozenset(getattr(
+    bot_config, 'REACTION_SHED_POLICIES',
+    ['dedupe', 'defer_xp', 'defer_edits']
+))
+STARBOARD_CONCURRENCY = getattr(bot_config, 'STARBOARD_CONCURRENCY', 4)
+# every post, edit, delete and reaction on a starboard goes through
+# here so that edits are coalesced and paced per channel
+outbound_scheduler = outbound.OutboundScheduler()
+# {(orig_message_id, starboard_id): the update to redo once posted},
+# for copies that are waiting in the outbound queue
+pending_posts: Dict[Tuple[int, int], Optional[Callable[[], None]]] = {}
+_post_tasks: Set[asyncio.Task] = set()
+
+
+def shedding(policy: str) -> bool:
+    """Whether `policy` from REACTION_SHED_POLICIES should be
+    applied right now"""
+    return reaction_workers.busy and policy in SHED_POLICIES
+
+
+def dedupe_key(*key) -> Optional[tuple]:
+    if 'dedupe' not in SHED_POLICIES:
+        return None
+    return key
+
+
+async def reaction_key(
+    db: Database,
+    message_id: int
+) -> int:
+    """The id that reaction events on `message_id` are queued
+    under: its original message, so that reactions on the original
+    and on its starboard copies are handled in order by one worker"""
+    result = db.message_links.cached(message_id)
+    if result is None:
+        async with db.acquire() as conn:
+            result = await functions.orig_message_id(db, conn, message_id)
+    return int(result[0])
 
 
 async def pretty_emoji_string(
@@ -29,7 +79,7 @@ async def pretty_emoji_string(
         if is_custom:
             emoji_string = str(
                 discord.utils.get(
-                    guild.emojis, id=int(emoji['d_id'])
+                    guild.emojis, id=emoji['d_id']
                 ) or "Deleted Emoji"
             )
         else:
@@ -48,6 +98,24 @@ class Starboard(commands.Cog):
         self.bot = bot
         self.db = db
 
+    def cog_unload(self) -> None:
+        reaction_workers.stop()
+        outbound_scheduler.stop()
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(
+        self,
+        payload: discord.RawMessageUpdateEvent
+    ) -> None:
+        self.db.embed_cache.invalidate(payload.message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(
+        self,
+        payload: discord.RawMessageDeleteEvent
+    ) -> None:
+        self.db.embed_cache.invalidate(payload.message_id)
+
     @commands.Cog.listener()
     async def on_raw_reaction_add(
         self,
@@ -69,10 +137,11 @@ class Starboard(commands.Cog):
         ):
             return
 
-        await handle_reaction(
-            self.bot.db, self.bot, guild_id, channel_id,
+        key = await reaction_key(self.bot.db, message_id)
+        reaction_workers.submit(key, partial(
+            handle_reaction, self.bot.db, self.bot, guild_id, channel_id,
             user_id, message_id, emoji, True
-        )
+        ), dedupe=dedupe_key(key, user_id, emoji_name), state=True)
 
     @commands.Cog.listener()
     async def on_raw_reaction_remove(
@@ -87,7 +156,7 @@ class Starboard(commands.Cog):
         user_id = payload.user_id
         emoji = payload.emoji
 
-        emoji_name = emoji.id if emoji.id is not None\
+        emoji_name = str(emoji.id) if emoji.id is not None\
             else emoji.name
 
         if not await functions.is_starboard_emoji(
@@ -95,10 +164,11 @@ class Starboard(commands.Cog):
         ):
             return
 
-        await handle_reaction(
-            self.bot.db, self.bot, guild_id, channel_id,
+        key = await reaction_key(self.bot.db, message_id)
+        reaction_workers.submit(key, partial(
+            handle_reaction, self.bot.db, self.bot, guild_id, channel_id,
             user_id, message_id, emoji, False
-        )
+        ), dedupe=dedupe_key(key, user_id, emoji_name), state=False)
 
     @flags.add_flag('--by', type=discord.User, default=None)
     @flags.add_flag('--stars', type=int, default=None)
@@ -145,12 +215,12 @@ class Starboard(commands.Cog):
                 WHERE is_trashed=False
                 AND is_forced=False
                 AND is_nsfw=False
-                AND ($2::numeric is null or user_id=$2)
+                AND ($2::bigint is null or user_id=$2)
             )
             AND guild_id=$1
             AND is_orig=False
             AND ($3::int is null or points >= $3)
-            AND ($4::numeric is null or channel_id=$4)
+            AND ($4::bigint is null or channel_id=$4)
             """
         )
         conn = self.bot.db.conn
@@ -171,13 +241,15 @@ class Starboard(commands.Cog):
         async with self.bot.db.lock:
             async with conn.transaction():
                 orig_mid, orig_cid = await functions.orig_message_id(
-                    self.bot.db, conn, int(sql_rand_message['id'])
+                    self.bot.db, conn, sql_rand_message['id']
                 )
 
         channel = self.bot.get_channel(orig_cid)
         m = await channel.fetch_message(orig_mid)
 
-        e, attachments = await functions.get_embed_from_message(m)
+        e, attachments = await functions.get_embed_from_message(
+            self.bot.db, m
+        )
 
         await ctx.send(
             f"**{sql_rand_message['points']} | {channel.mention}**",
@@ -576,25 +648,70 @@ async def handle_reaction(
 ) -> None:
     emoji_name = _emoji.name if _emoji.id is None else str(_emoji.id)
 
-    check_reaction = \
-        """SELECT * FROM reactions
-        WHERE message_id=$1
-        AND user_id=$2
-        AND name=$3"""
     remove_reaction = \
         """DELETE FROM reactions
         WHERE message_id=$1
         AND user_id=$2
-        AND name=$3"""
+        AND name=$3
+        RETURNING id"""
     get_message = \
         """SELECT * FROM messages WHERE id=$1"""
     get_user = \
         """SELECT * FROM users WHERE id=$1"""
     get_member = \
         """SELECT * FROM members WHERE user_id=$1 and guild_id=$2"""
-
-    async with db.lock:
-        conn = await db.connect()
+    create_message = \
+        """INSERT INTO messages (id, guild_id,
+        user_id, orig_message_id, channel_id,
+        is_orig, is_nsfw)
+        VALUES($1,$2,$3,$4,$5,$6,$7)"""
+    # the unique index on (message_id, user_id, name) decides which
+    # of two concurrent adds stores the reaction, and only that one
+    # gets a row back and changes the counts
+    create_reaction = \
+        """INSERT INTO reactions (guild_id,
+        user_id, message_id, name)
+        VALUES ($1,$2,$3,$4)
+        ON CONFLICT (message_id, user_id, name) DO NOTHING
+        RETURNING id"""
+    increment_count = \
+        """INSERT INTO reaction_counts (message_id, name, count)
+        VALUES ($1, $2, 1)
+        ON CONFLICT (message_id, name) DO UPDATE
+        SET count=reaction_counts.count+1"""
+    decrement_count = \
+        """UPDATE reaction_counts
+        SET count=GREATEST(count-1, 0)
+        WHERE message_id=$1 AND name=$2"""
+    # A user counts once per starboard however many of its emojis
+    # they use, so the points only move when this was their first
+    # (or last) reaction with one of that starboard's emojis.
+    update_points = \
+        """WITH remaining AS (
+            SELECT sbemojis.starboard_id, COUNT(*) AS n FROM reactions
+            JOIN sbemojis ON sbemojis.name=reactions.name
+            WHERE reactions.message_id=$1
+            AND reactions.user_id=$2
+            AND sbemojis.starboard_id=ANY($3::bigint[])
+            GROUP BY sbemojis.starboard_id
+        )
+        UPDATE messages
+        SET points=GREATEST(messages.points+$4, 0)
+        FROM starboards, messages orig
+        WHERE messages.orig_message_id=$1
+        AND messages.channel_id=ANY($3::bigint[])
+        AND messages.points IS NOT NULL
+        AND starboards.id=messages.channel_id
+        AND orig.id=$1
+        AND orig.is_frozen=False
+        AND (starboards.self_star OR orig.user_id!=$2)
+        AND COALESCE((
+            SELECT n FROM remaining
+            WHERE remaining.starboard_id=messages.channel_id
+        ), 0)=$5
+        RETURNING messages.channel_id, messages.points"""
+
+    async with db.acquire() as conn:
         async with conn.transaction():
             message_id, orig_channel_id = await functions.orig_message_id(
                 db, conn, _message_id
@@ -643,34 +760,60 @@ async def handle_reaction(
         guild_id=guild_id
     )
 
-    async with db.lock:
-        conn = await db.connect()
+    # the starboards whose points this reaction can change
+    config = await db.config_cache.get(guild_id)
+    starboard_ids = list(config.emoji_starboards(emoji_name))
+    if any(config.starboard_filter(sid).has_roles for sid in starboard_ids):
+        members = await functions.get_members([user_id], guild)
+        if len(members) > 0:
+            role_ids = {r.id for r in members[0].roles}
+            starboard_ids = [
+                sid for sid in starboard_ids
+                if not config.starboard_filter(sid).member_blocked(role_ids)
+            ]
+
+    new_points = []
+    async with db.acquire() as conn:
         async with conn.transaction():
             rows = await conn.fetch(get_message, message_id)
             if message:
                 if len(rows) == 0:
-                    await db.q.create_message.fetch(
-                        message_id, guild_id,
+                    await conn.execute(
+                        create_message, message_id, guild_id,
                         message.author.id, None,
                         channel_id, True,
                         message.channel.is_nsfw()
                     )
             try:
-                rows = await conn.fetch(
-                    check_reaction, message_id, user_id, emoji_name
-                )
-                exists = len(rows) > 0
-                if not exists and is_add:
-                    await db.q.create_reaction.fetch(
-                        guild_id, user_id,
+                if is_add:
+                    stored = await conn.fetchval(
+                        create_reaction, guild_id, user_id,
                         message_id, emoji_name
                     )
-                if exists and not is_add:
-                    await conn.execute(
+                    if stored is not None:
+                        await conn.execute(
+                            increment_count, message_id, emoji_name
+                        )
+                        new_points = await conn.fetch(
+                            update_points, message_id, user_id,
+                            starboard_ids, 1, 1
+                        )
+                else:
+                    stored = await conn.fetchval(
                         remove_reaction, message_id, user_id, emoji_name
                     )
+                    if stored is not None:
+                        await conn.execute(
+                            decrement_count, message_id, emoji_name
+                        )
+                        new_points = await conn.fetch(
+                            update_points, message_id, user_id,
+                            starboard_ids, -1, 0
+                        )
             except asyncpg.exceptions.ForeignKeyViolationError:
                 pass
+    for r in new_points:
+        db.message_links.set_points(message_id, r['channel_id'], r['points'])
 
     if message is not None:
         handle_level = False
@@ -682,14 +825,28 @@ async def handle_reaction(
             handle_level = True
 
         if handle_level:
-            await levels.handle_reaction(
+            level_update = partial(
+                levels.handle_reaction,
                 bot, user_id, message.author, guild, _emoji, is_add
             )
+            if shedding('defer_xp'):
+                # never coalesced, since every add and remove
+                # changes XP and their order matters
+                reaction_workers.defer(
+                    None, level_update, worker_key=message_id
+                )
+            else:
+                await level_update()
 
-    await handle_starboards(db, bot, message_id, channel, message, guild)
+    update_debouncer.schedule(
+        int(message_id), partial(
+            queue_starboard_update, db, bot, message_id, channel, message,
+            guild
+        )
+    )
 
 
-async def handle_starboards(
+async def queue_starboard_update(
     db: Database,
     bot: commands.Bot,
     message_id: int,
@@ -697,36 +854,94 @@ async def handle_starboards(
     message: Optional[discord.Message],
     guild: discord.Guild
 ) -> None:
+    """Runs handle_starboards on the message's worker, so that it
+    is ordered with the message's reaction events and counts
+    towards the pool's limits. If the worker's queue is full the
+    update is deferred instead of dropped."""
+    job = partial(
+        handle_starboards, db, bot, message_id, channel, message, guild
+    )
+    if not reaction_workers.submit(message_id, job):
+        reaction_workers.defer(
+            ('edit', message_id), job, worker_key=message_id
+        )
+
+
+async def handle_starboards(
+    db: Database,
+    bot: commands.Bot,
+    message_id: int,
+    channel: discord.TextChannel,
+    message: Optional[discord.Message],
+    guild: discord.Guild,
+    recount: bool = False
+) -> None:
+    """Updates the message on every starboard of the guild.
+
+    Points of messages that are already on a starboard are kept
+    up to date by handle_reaction, so they are only recounted from
+    scratch when `recount` is True (e.g. sb!recount, unfreezing)."""
     get_message = \
         """SELECT * FROM messages WHERE id=$1"""
-    get_starboards = \
-        """SELECT * FROM starboards
-        WHERE guild_id=$1
-        AND locked=False"""
+    get_author = \
+        """SELECT * FROM users WHERE id=$1"""
+    get_counts = \
+        """SELECT name, count FROM reaction_counts WHERE message_id=$1"""
 
-    sql_starboards = []
+    defer_edits = not recount and shedding('defer_edits')
 
-    async with db.lock:
-        conn = await db.connect()
+    # everything that doesn't depend on the starboard is loaded
+    # once here and shared by all of them
+    async with db.acquire() as conn:
         async with conn.transaction():
             sql_message = await conn.fetchrow(get_message, message_id)
-            if sql_message is not None:
-                sql_starboards = await conn.fetch(
-                    get_starboards, sql_message['guild_id']
+            if sql_message is None:
+                return
+            sql_author = await conn.fetchrow(
+                get_author, sql_message['user_id']
+            )
+            copies = await db.message_links.copies(conn, message_id)
+            counts = {
+                r['name']: r['count']
+                for r in await conn.fetch(get_counts, message_id)
+            }
+
+    config = await db.config_cache.get(sql_message['guild_id'])
+    sql_starboards = [
+        s for s in config.starboards.values() if not s['locked']
+    ]
+    if defer_edits and any(s['id'] in copies for s in sql_starboards):
+        # New posts go out now, messages that are already on a
+        # starboard get updated once the backlog is gone. The
+        # deferred run handles every starboard again, which is
+        # harmless since posting is idempotent.
+        reaction_workers.defer(
+            ('edit', message_id), partial(
+                handle_starboards, db, bot, message_id, channel,
+                message, guild
+            ), worker_key=message_id
+        )
+        sql_starboards = [
+            s for s in sql_starboards if s['id'] not in copies
+        ]
+
+    shared = {'author': sql_author, 'copies': copies, 'counts': counts}
+    semaphore = asyncio.Semaphore(STARBOARD_CONCURRENCY)
+
+    async def run(sql_starboard: dict) -> None:
+        async with semaphore:
+            try:
+                await handle_starboard(
+                    db, bot, sql_message, message, sql_starboard,
+                    guild, shared, recount=recount
                 )
+            except Exception:
+                # one broken starboard shouldn't keep the message
+                # from being updated on the others
+                print(f"Error updating starboard {sql_starboard['id']}")
+                traceback.print_exc()
 
-    b = edit_message_cooldown.get_bucket(message_id)
-    retry_after = b.update_rate_limit()
-    on_cooldown = False
-    if retry_after:
-        on_cooldown = True
-
-    if sql_message is not None:
-        for sql_starboard in sql_starboards:
-            await handle_starboard(
-                db, bot, sql_message, message, sql_starboard,
-                guild, on_cooldown=on_cooldown
-            )
+    await asyncio.gather(*[run(s) for s in sql_starboards])
 
 
 async def handle_starboard(
@@ -736,88 +951,96 @@ async def handle_starboard(
     message: Optional[discord.Message],
     sql_starboard: dict,
     guild: discord.Guild,
-    on_cooldown=False
+    shared: dict,
+    recount=False
 ) -> None:
-    get_starboard_message = \
-        """SELECT * FROM messages WHERE orig_message_id=$1 AND channel_id=$2"""
+    """Updates the message on one starboard. `shared` holds the
+    per-message state loaded by handle_starboards ('author',
+    'copies' and 'counts'), and is also used by calculate_points
+    to share the reactors between starboards."""
     delete_starboard_message = \
         """DELETE FROM messages WHERE orig_message_id=$1 and channel_id=$2"""
-    get_author = \
-        """SELECT * FROM users WHERE id=$1"""
-    get_sbemojis = \
-        """SELECT * FROM sbemojis WHERE starboard_id=$1"""
 
     starboard_id = sql_starboard['id']
-    starboard = bot.get_channel(int(starboard_id))
+    starboard = bot.get_channel(starboard_id)
 
     if starboard is None:
         return
 
-    async with db.lock:
-        conn = await db.connect()
-        async with conn.transaction():
-            sql_author = await conn.fetchrow(
-                get_author, sql_message['user_id']
-            )
-            sql_starboard_message = await conn.fetchrow(
-                get_starboard_message, sql_message['id'], sql_starboard['id']
+    key = (int(sql_message['id']), starboard_id)
+    if key in pending_posts:
+        # The copy hasn't been posted yet, so there is nothing to
+        # edit or remove. This update is redone once it has been.
+        pending_posts[key] = partial(
+            update_debouncer.schedule, key[0], partial(
+                queue_starboard_update, db, bot, key[0],
+                bot.get_channel(int(sql_message['channel_id'])),
+                message, guild
             )
+        )
+        return
+
+    sql_author = shared['author']
+    # [sb_message_id, points]
+    link = shared['copies'].get(starboard_id)
+
+    if link is None and not sql_message['is_forced']:
+        # Nothing happens to a message that isn't on this starboard
+        # until it can reach the required points, and the reaction
+        # tally is an upper bound on its points.
+        config = await db.config_cache.get(sql_starboard['guild_id'])
+        upper_bound = sum(
+            shared['counts'].get(name, 0)
+            for name in config.sbemoji_names.get(starboard_id, ())
+        )
+        if upper_bound < sql_starboard['required']:
+            return
 
     delete = False
-    if sql_starboard_message is None:
+    if link is None:
         starboard_message = None
     else:
-        starboard_message_id = sql_starboard_message['id']
+        starboard_message_id = link[0]
         if starboard is not None:
             try:
                 starboard_message = await functions.fetch(
-                    bot, int(starboard_message_id), starboard
+                    bot, starboard_message_id, starboard
                 )
             except discord.errors.NotFound:
                 starboard_message = None
-                async with db.lock:
-                    conn = await db.connect()
-                    async with conn.transaction():
-                        await conn.execute(
-                            delete_starboard_message, sql_message['id'],
-                            sql_starboard['id']
-                        )
+                delete = True
         else:
             starboard_message = None
             delete = True
 
-    async with db.lock:
-        conn = await db.connect()
-        async with conn.transaction():
-            if delete:
+    if delete:
+        async with db.acquire() as conn:
+            async with conn.transaction():
                 await conn.execute(
                     delete_starboard_message, sql_message['id'],
                     sql_starboard['id']
                 )
+        db.message_links.remove_copy(sql_message['id'], starboard_id)
 
-    recount = True
-    if sql_starboard_message is not None and\
-            sql_starboard_message['points'] is not None:
-        if sql_message['is_frozen']:
-            recount = False
-        if on_cooldown:
-            recount = False
+    if link is None or link[1] is None:
+        recount = True
+    elif sql_message['is_frozen']:
+        recount = False
 
     if recount:
         points, emojis = await functions.calculate_points(
-            conn, sql_message, sql_starboard, bot,
-            guild
+            sql_message, sql_starboard, bot,
+            guild, shared=shared
         )
     else:
-        points = sql_starboard_message['points']
-        async with bot.db.lock:
-            async with conn.transaction():
-                emojis = await conn.fetch(get_sbemojis, sql_starboard['id'])
+        points = link[1]
+        config = await db.config_cache.get(sql_starboard['guild_id'])
+        emojis = config.sbemojis.get(sql_starboard['id'], [])
 
     deleted = message is None
     blacklisted = False if deleted else \
         await functions.is_message_blacklisted(
-            bot, message, int(sql_starboard['id'])
+            bot, message, sql_starboard['id']
         )
     on_starboard = starboard_message is not None
 
@@ -865,7 +1088,7 @@ async def handle_starboard(
     await update_message(
         db, message, sql_message['channel_id'], starboard_message,
         starboard, points, forced, frozen, trashed, add, remove, link_edits,
-        emojis, on_cooldown=on_cooldown
+        emojis
     )
 
 
@@ -882,29 +1105,18 @@ async def update_message(
     add: bool,
     remove: bool,
     link_edits: bool,
-    emojis: List[dict],
-    on_cooldown: bool = False
+    emojis: List[dict]
 ) -> None:
     update = orig_message is not None
 
-    check_message = \
-        """SELECT * FROM messages WHERE orig_message_id=$1 AND channel_id=$2"""
-
     if trashed:
         if sb_message is not None:
             embed = discord.Embed(title='Trashed Message')
             embed.description = "This message was trashed by a moderator."
-            if not on_cooldown:
-                try:
-                    await sb_message.edit(embed=embed)
-                except discord.errors.NotFound:
-                    pass
+            outbound_scheduler.edit(sb_message, embed=embed)
     elif remove:
-        try:
-            if sb_message is not None:
-                await sb_message.delete()
-        except discord.errors.NotFound:
-            pass
+        if sb_message is not None:
+            outbound_scheduler.delete(sb_message)
     else:
         plain_text = (
             f"**{points} | <#{orig_channel_id}>{' | 🔒' if forced else ''}"
@@ -912,67 +1124,114 @@ async def update_message(
         )
 
         embed, attachments = await functions.get_embed_from_message(
-            orig_message
+            db, orig_message, with_files=add
         ) if orig_message is not None else (None, None)
 
         if add and embed is not None:
-            async with db.lock:
-                conn = db.conn
+            async with db.acquire() as conn:
                 async with conn.transaction():
-                    _message = await conn.fetchrow(
-                        check_message, orig_message.id,
-                        starboard.id
+                    _link = await db.message_links.get_copy(
+                        conn, orig_message.id, starboard.id
                     )
-            if _message is not None:
+            if _link is not None:
                 return
-            try:
-                sb_message = await starboard.send(
-                    plain_text, embed=embed, files=attachments
-                )
-            except discord.errors.Forbidden:
-                pass
-            else:
-                async with db.lock:
-                    conn = await db.connect()
-                    async with conn.transaction():
-                        _message = await conn.fetchrow(
-                            check_message, orig_message.id,
-                            starboard.id
-                        )
-                        if _message is None:
-                            await db.q.create_message.fetch(
-                                sb_message.id, sb_message.guild.id,
-                                orig_message.author.id, orig_message.id,
-                                starboard.id, False,
-                                orig_message.channel.is_nsfw()
-                            )
-                if _message is not None:
-                    print("### DUPLICATE DELETED ###")
-                    await sb_message.delete()
-
+            key = (orig_message.id, starboard.id)
+            if key in pending_posts:
+                return
+            pending_posts[key] = None
+            task = asyncio.create_task(post_message(
+                db, orig_message, starboard, plain_text, embed,
+                attachments, emojis
+            ))
+            _post_tasks.add(task)
+            task.add_done_callback(_post_done)
         elif update and sb_message and link_edits:
-            if not on_cooldown:
-                await sb_message.edit(
-                    content=plain_text, embed=embed
-                )
+            outbound_scheduler.edit(
+                sb_message, content=plain_text, embed=embed
+            )
         elif sb_message:
-            await sb_message.edit(
-                content=plain_text
+            outbound_scheduler.edit(sb_message, content=plain_text)
+
+
+async def post_message(
+    db: Database,
+    orig_message: discord.Message,
+    starboard: discord.TextChannel,
+    plain_text: str,
+    embed: discord.Embed,
+    attachments: List[discord.File],
+    emojis: List[dict]
+) -> None:
+    """Posts `orig_message` to `starboard` and records the copy.
+
+    This runs in its own task, since the post can wait behind the
+    channel's rate limit for a while and the reaction worker that
+    queued it shouldn't wait with it. Until the copy is recorded,
+    handle_starboard leaves the message alone on this starboard,
+    and redoes the last update it skipped afterwards."""
+    check_message = \
+        """SELECT * FROM messages WHERE orig_message_id=$1 AND channel_id=$2"""
+    create_message = \
+        """INSERT INTO messages (id, guild_id,
+        user_id, orig_message_id, channel_id,
+        is_orig, is_nsfw)
+        VALUES($1,$2,$3,$4,$5,$6,$7)"""
+
+    key = (orig_message.id, starboard.id)
+    try:
+        try:
+            sb_message = await outbound_scheduler.post(
+                starboard, plain_text, embed=embed, files=attachments
             )
-    if sb_message is not None and not remove and add:
-        for _emoji in emojis:
-            if _emoji['d_id'] is not None:
-                emoji = utils.get(
-                    starboard.guild.emojis, id=int(_emoji['d_id'])
+        except discord.errors.Forbidden:
+            return
+
+        async with db.acquire() as conn:
+            async with conn.transaction():
+                _message = await conn.fetchrow(
+                    check_message, orig_message.id, starboard.id
                 )
-                if emoji is None:
-                    continue
-            else:
-                emoji = _emoji['name']
-            try:
-                await sb_message.add_reaction(emoji)
-            except Exception:
-                pass
+                if _message is None:
+                    await conn.execute(
+                        create_message,
+                        sb_message.id, sb_message.guild.id,
+                        orig_message.author.id, orig_message.id,
+                        starboard.id, False,
+                        orig_message.channel.is_nsfw()
+                    )
+        if _message is not None:
+            print("### DUPLICATE DELETED ###")
+            outbound_scheduler.delete(sb_message)
+            db.message_links.add_copy(
+                orig_message.id, orig_message.channel.id,
+                starboard.id, _message['id']
+            )
+            # the existing copy already has its reactions
+            return
+        db.message_links.add_copy(
+            orig_message.id, orig_message.channel.id,
+            starboard.id, sb_message.id
+        )
+        outbound_scheduler.seed_reactions(
+            sb_message, functions.resolve_emojis(
+                starboard.guild, [e['name'] for e in emojis]
+            )
+        )
+    finally:
+        redo = pending_posts.pop(key, None)
+        if redo is not None:
+            redo()
+
+
+def _post_done(
+    task: asyncio.Task
+) -> None:
+    _post_tasks.discard(task)
+    if task.cancelled():
+        return
+    e = task.exception()
+    if e is not None:
+        traceback.print_exception(type(e), e, e.__traceback__)
 
 
 def setup(
@@ -38,8 +38,7 @@ async def handle_trashing(
 
     status = True
 
-    async with db.lock:
-        conn = await db.connect()
+    async with db.acquire() as conn:
         async with conn.transaction():
             message_id, channel_id = await functions.orig_message_id(
                 db, conn, _message_id
@@ -47,13 +46,15 @@ async def handle_trashing(
 
             sql_message = await conn.fetchrow(check_message, message_id)
             if sql_message is None:
-                await ctx.send(
-                    "That message either has no reactions or does not exist"
-                )
                 status = False
             else:
                 await conn.execute(trash_message, trash, message_id)
 
+    if status is False:
+        await ctx.send(
+            "That message either has no reactions or does not exist"
+        )
+
     channel = bot.get_channel(int(channel_id))
     try:
         message = await functions.fetch(bot, message_id, channel)
@@ -76,6 +77,11 @@ async def handle_forcing(
 ) -> None:
     check_message = \
         """SELECT * FROM messages WHERE id=$1"""
+    create_message = \
+        """INSERT INTO messages (id, guild_id,
+        user_id, orig_message_id, channel_id,
+        is_orig, is_nsfw)
+        VALUES($1,$2,$3,$4,$5,$6,$7)"""
     force_message = \
         """UPDATE messages
         SET is_forced=$1
@@ -94,8 +100,7 @@ async def handle_forcing(
         await ctx.send("I can't find that channel")
         return
 
-    async with bot.db.lock:
-        conn = await bot.db.connect()
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             message_id, channel_id = await functions.orig_message_id(
                 bot.db, conn, _message_id
@@ -112,12 +117,12 @@ async def handle_forcing(
         do_member=True
     )
 
-    async with bot.db.lock:
-        conn = await bot.db.connect()
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             sql_message = await conn.fetchrow(check_message, message_id)
             if sql_message is None:
-                await bot.db.q.create_message.fetch(
+                await conn.execute(
+                    create_message,
                     message.id, ctx.guild.id, message.author.id,
                     None, message.channel.id, True,
                     message.channel.is_nsfw()
@@ -253,8 +258,7 @@ class Utility(commands.Cog):
             """SELECT * FROM messages
             WHERE is_frozen = True AND guild_id=$1"""
 
-        async with self.db.lock:
-            conn = await self.db.connect()
+        async with self.db.acquire() as conn:
             async with conn.transaction():
                 frozen_messages = await conn.fetch(get_frozen, ctx.guild.id)
 
@@ -307,8 +311,7 @@ class Utility(commands.Cog):
             SET is_frozen = True
             WHERE id=$1"""
 
-        async with self.db.lock:
-            conn = await self.db.connect()
+        async with self.db.acquire() as conn:
             async with conn.transaction():
                 message_id, _orig_channel_id = await functions.orig_message_id(
                     self.db, conn, message
@@ -358,8 +361,7 @@ class Utility(commands.Cog):
             SET is_frozen = False
             WHERE id=$1"""
 
-        async with self.db.lock:
-            conn = await self.db.connect()
+        async with self.db.acquire() as conn:
             async with conn.transaction():
                 message_id, _orig_channel_id = await functions.orig_message_id(
                     self.db, conn, message
@@ -384,7 +386,7 @@ class Utility(commands.Cog):
 
         await handle_starboards(
             self.bot.db, self.bot, mid, channel,
-            message_obj, ctx.guild
+            message_obj, ctx.guild, recount=True
         )
 
         await ctx.send(message)
@@ -475,8 +477,7 @@ class Utility(commands.Cog):
         self,
         ctx: commands.Context
     ) -> None:
-        cache = self.bot.db.cache
-        cache._messages[ctx.guild.id] = []
+        self.bot.db.cache.clear_guild(ctx.guild.id)
         await ctx.send("Message cache cleared")
 
     @commands.command(
@@ -498,8 +499,7 @@ class Utility(commands.Cog):
 
         sql_sb_messages = []
 
-        async with self.db.lock:
-            conn = await self.bot.db.connect()
+        async with self.db.acquire() as conn:
             async with conn.transaction():
                 orig_message_id, _ = await functions.orig_message_id(
                     self.bot.db, conn, message_id
@@ -604,6 +604,11 @@ class Utility(commands.Cog):
 
         check_message = \
             """SELECT * FROM messages WHERE id=$1"""
+        create_message = \
+            """INSERT INTO messages (id, guild_id,
+            user_id, orig_message_id, channel_id,
+            is_orig, is_nsfw)
+            VALUES($1,$2,$3,$4,$5,$6,$7)"""
 
         await functions.check_or_create_existence(
             self.bot,
@@ -612,14 +617,14 @@ class Utility(commands.Cog):
             do_member=True
         )
 
-        conn = self.bot.db.conn
-        async with self.bot.db.lock:
+        async with self.bot.db.acquire() as conn:
             async with conn.transaction():
                 sql_message = await conn.fetchrow(
                     check_message, message.id
                 )
                 if sql_message is None:
-                    await self.bot.db.q.create_message.fetch(
+                    await conn.execute(
+                        create_message,
                         message.id, message.guild.id,
                         message.author.id, None,
                         message.channel.id, True,
@@ -644,7 +649,7 @@ class Utility(commands.Cog):
             await functions.recount_reactions(self.bot, message)
             await handle_starboards(
                 self.bot.db, self.bot, message.id,
-                message.channel, message, ctx.guild
+                message.channel, message, ctx.guild, recount=True
             )
 
         await ctx.send("Finished!")
@@ -678,9 +683,7 @@ class Utility(commands.Cog):
             """SELECT * FROM aschannels
             WHERE id=$1"""
 
-        conn = self.bot.db.conn
-
-        async with self.bot.db.lock:
+        async with self.bot.db.acquire() as conn:
             async with conn.transaction():
                 is_sb = await conn.fetchrow(
                     get_starboard, current_channel.id
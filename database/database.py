@@ -1,11 +1,20 @@
+import asyncio
 import asyncpg as apg
 import os
+import sys
 import time
+import traceback
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from discord.ext import commands
 from dotenv import load_dotenv
 from asyncio import Lock
 from discord import utils
-from typing import Any
+from typing import (
+    Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List,
+    Optional, Tuple
+)
 
 load_dotenv()
 db_pwd = os.getenv('DB_PWD')
@@ -25,44 +34,161 @@ class aobject(object):
         pass
 
 
+# every column that holds a discord id, by table
+SNOWFLAKE_COLUMNS = {
+    'guilds': ['id'],
+    'xproles': ['id', 'guild_id'],
+    'posroles': ['id', 'guild_id'],
+    'users': ['id'],
+    'votes': ['user_id'],
+    'members': ['user_id', 'guild_id'],
+    'starboards': ['id', 'guild_id'],
+    'sbemojis': ['d_id', 'starboard_id'],
+    'aschannels': ['id', 'guild_id'],
+    'asemojis': ['aschannel_id'],
+    'channelbl': ['starboard_id', 'channel_id', 'guild_id'],
+    'rolebl': ['starboard_id', 'role_id', 'guild_id'],
+    'messages': [
+        'id', 'guild_id', 'user_id', 'orig_message_id', 'channel_id'
+    ],
+    'reactions': ['guild_id', 'user_id', 'message_id'],
+}
+
+
+class SqlStats:
+    """Collects query runtimes in memory until they are dumped.
+
+    Statements are interned to an integer id the first time they
+    are seen, so recording a query is a dict lookup plus a few
+    list updates. Runtimes go into a log scale histogram so that
+    percentiles can be worked out later."""
+    # bucket i holds runtimes <= BOUNDS[i]; 10us up to ~100s
+    BOUNDS = tuple(0.00001 * 1.5**i for i in range(40))
+
+    def __init__(self) -> None:
+        self._ids = {}  # {raw sql: id}
+        self._normalized = {}  # {lowercased sql: id}
+        self.sql = []  # [normalized sql], indexed by id
+        self._reset()
+
+    def _reset(self) -> None:
+        size = len(self.sql)
+        self.counts = [0] * size
+        self.totals = [0.0] * size
+        self.buckets = [[0] * len(self.BOUNDS) for _ in range(size)]
+
+    def _intern(
+        self,
+        sql: str
+    ) -> int:
+        normalized = sql.lower()
+        sid = self._normalized.get(normalized)
+        if sid is None:
+            sid = len(self.sql)
+            self._normalized[normalized] = sid
+            self.sql.append(normalized)
+            self.counts.append(0)
+            self.totals.append(0.0)
+            self.buckets.append([0] * len(self.BOUNDS))
+        self._ids[sql] = sid
+        return sid
+
+    def record(
+        self,
+        sql: str,
+        elapsed: float
+    ) -> None:
+        sid = self._ids.get(sql)
+        if sid is None:
+            sid = self._intern(sql)
+        self.counts[sid] += 1
+        self.totals[sid] += elapsed
+        bucket = bisect_left(self.BOUNDS, elapsed)
+        self.buckets[sid][min(bucket, len(self.BOUNDS) - 1)] += 1
+
+    def take(self) -> List[Tuple[str, int, float, List[int]]]:
+        """Returns [(sql, count, total_time, buckets), ...] for
+        every statement that ran since the last call, and resets
+        the counters."""
+        rows = [
+            (self.sql[sid], count, self.totals[sid], self.buckets[sid])
+            for sid, count in enumerate(self.counts) if count > 0
+        ]
+        self._reset()
+        return rows
+
+    def restore(
+        self,
+        rows: List[Tuple[str, int, float, List[int]]]
+    ) -> None:
+        """Adds rows returned by take() back, for when they
+        couldn't be saved"""
+        for sql, count, total, buckets in rows:
+            sid = self._normalized.get(sql)
+            if sid is None:
+                sid = self._intern(sql)
+            self.counts[sid] += count
+            self.totals[sid] += total
+            self.buckets[sid] = [
+                a + b for a, b in zip(self.buckets[sid], buckets)
+            ]
+
+    @classmethod
+    def percentile(
+        cls,
+        buckets: List[int],
+        q: float
+    ) -> float:
+        total = sum(buckets)
+        if total == 0:
+            return 0.0
+        needed = q * total
+        seen = 0
+        for x, count in enumerate(buckets):
+            seen += count
+            if seen >= needed:
+                return cls.BOUNDS[x]
+        return cls.BOUNDS[-1]
+
+
 class CustomConn:
     def __init__(
         self,
-        realcon: apg.Connection
+        realcon: apg.Connection,
+        stats: SqlStats = None
     ) -> None:
         self.realcon = realcon
-        self.sql_dict = {}
+        # pooled connections share the stats of the main
+        # connection so that dump() still sees every query
+        self.stats = stats if stats is not None else SqlStats()
 
     async def dump(self) -> None:  # requires external lock
-        add_row = \
-            """INSERT INTO sqlruntimes (sql, count, time)
-            values ($1, $2, $3)"""
-        update_row = \
-            """UPDATE sqlruntimes
-            SET count=$2,
-            time=$3
-            WHERE sql=$1"""
-        check_row = \
-            """SELECT * FROM sqlruntimes
-            WHERE sql=$1"""
-
-        conn = self.realcon
-
-        async with self.realcon.transaction():
-            for sql, d in self.sql_dict.items():
-                row = await conn.fetchrow(check_row, sql)
-                if row is None:
-                    await conn.execute(
-                        add_row, sql, d['c'], d['e']
-                    )
-                else:
-                    await conn.execute(
-                        update_row, sql,
-                        d['c']+row['count'],
-                        d['e']+float(row['time'])
-                    )
+        upsert_row = \
+            """INSERT INTO sqlruntimes (sql, count, time, buckets)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (sql) DO UPDATE
+            SET count=sqlruntimes.count+EXCLUDED.count,
+            time=sqlruntimes.time+EXCLUDED.time,
+            buckets=(
+                SELECT array_agg(
+                    COALESCE(old, 0)+COALESCE(new, 0) ORDER BY x
+                ) FROM unnest(sqlruntimes.buckets, EXCLUDED.buckets)
+                WITH ORDINALITY AS b(old, new, x)
+            )"""
 
-        self.sql_dict = {}
+        rows = self.stats.take()
+        if len(rows) == 0:
+            return
+
+        try:
+            async with self.realcon.transaction():
+                await self.realcon.executemany(upsert_row, rows)
+        except BaseException:
+            # queries recorded while this ran are already in the new
+            # counters, so the snapshot is merged back into them
+            # rather than reset, to be saved by the next dump
+            self.stats.restore(rows)
+            raise
 
     def transaction(
         self, *args, **kwargs
@@ -72,12 +198,9 @@ class CustomConn:
     def log(
         self,
         sql: str,
-        time: float
+        elapsed: float
     ) -> None:
-        sql = sql.lower()
-        self.sql_dict.setdefault(sql, {'c': 0, 'e': 0})
-        self.sql_dict[sql]['c'] += 1
-        self.sql_dict[sql]['e'] += time
+        self.stats.record(sql, elapsed)
 
     async def prepare(
         self,
@@ -90,9 +213,9 @@ class CustomConn:
         sql: str,
         *args, **kwargs
     ):
-        s = time.time()
+        s = time.perf_counter()
         result = await self.realcon.execute(sql, *args, **kwargs)
-        self.log(sql, time.time() - s)
+        self.log(sql, time.perf_counter() - s)
         return result
 
     async def fetch(
@@ -100,9 +223,9 @@ class CustomConn:
         sql: str,
         *args, **kwargs
     ):
-        s = time.time()
+        s = time.perf_counter()
         result = await self.realcon.fetch(sql, *args, **kwargs)
-        self.log(sql, time.time() - s)
+        self.log(sql, time.perf_counter() - s)
         return result
 
     async def fetchrow(
@@ -110,59 +233,184 @@ class CustomConn:
         sql: str,
         *args, **kwargs
     ):
-        s = time.time()
+        s = time.perf_counter()
         result = await self.realcon.fetchrow(sql, *args, **kwargs)
-        self.log(sql, time.time() - s)
+        self.log(sql, time.perf_counter() - s)
         return result
 
     async def fetchval(self, sql, *args, **kwargs):
-        s = time.time()
+        s = time.perf_counter()
         result = await self.realcon.fetchval(sql, *args, **kwargs)
-        self.log(sql, time.time() - s)
+        self.log(sql, time.perf_counter() - s)
         return result
 
 
+def _message_size(
+    msg: Any
+) -> int:
+    """Roughly how many bytes `msg` keeps alive. Only the parts that
+    belong to the message are counted; the author, channel and guild
+    are shared with the rest of the client's cache."""
+    size = sys.getsizeof(msg) + sys.getsizeof(msg.content or '')
+    for embed in msg.embeds:
+        size += sys.getsizeof(str(embed.to_dict()))
+    for attachment in msg.attachments:
+        size += sys.getsizeof(attachment) + \
+            sys.getsizeof(attachment.url) * 2
+    size += sys.getsizeof(msg.reactions) + \
+        sys.getsizeof(msg.mentions) + sys.getsizeof(msg.role_mentions)
+    return size
+
+
 class BotCache(aobject):
+    """LRU cache of discord messages, keyed by message id.
+
+    There is a global limit on the number of messages, and a limit
+    per guild so that one busy guild can't push every other guild
+    out. Since a message with long content, embeds or many
+    attachments is much bigger than a short one, the estimated size
+    of the cached messages is also kept under `max_bytes`. Messages
+    also expire after `ttl` seconds, since their reactions and
+    content go stale."""
     async def __init__(
         self,
         event,
-        limit: int = 20
+        max_size: int = 5000,
+        guild_limit: int = 50,
+        ttl: float = 600,
+        max_bytes: int = 64 * 1024 * 1024
     ) -> None:
-        self._messages = {}
-        self.limit = limit
+        # {message_id: (message, guild_id, expires_at, size)}
+        self._messages = OrderedDict()
+        # {guild_id: OrderedDict({message_id: None})}
+        self._guilds = {}
+        self.max_size = max_size
+        self.guild_limit = guild_limit
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
         await self.set_listeners(event)
 
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def _pop(
+        self,
+        msg_id: int
+    ) -> Optional[Any]:
+        entry = self._messages.pop(msg_id, None)
+        if entry is None:
+            return None
+        msg, guild, _expires, size = entry
+        self._bytes -= size
+        guild_messages = self._guilds.get(guild)
+        if guild_messages is not None:
+            guild_messages.pop(msg_id, None)
+            if len(guild_messages) == 0:
+                del self._guilds[guild]
+        return msg
+
     async def push(
         self,
         item: Any,
         guild: int
     ) -> None:
-        self._messages.setdefault(guild, [])
-        self._messages[guild].append(item)
-        if len(self._messages[guild]) > self.limit:
-            self._messages[guild].pop(0)
+        self._pop(item.id)
+        size = _message_size(item)
+        self._messages[item.id] = (
+            item, guild, time.monotonic() + self.ttl, size
+        )
+        self._bytes += size
+        guild_messages = self._guilds.setdefault(guild, OrderedDict())
+        guild_messages[item.id] = None
+
+        if len(guild_messages) > self.guild_limit:
+            self._pop(next(iter(guild_messages)))
+            self.evictions += 1
+        while self._messages and (
+            len(self._messages) > self.max_size
+            or self._bytes > self.max_bytes
+        ):
+            self._pop(next(iter(self._messages)))
+            self.evictions += 1
 
     async def get(
         self,
         guild: int,
         **kwargs
     ) -> Any:
-        return utils.get(self._messages.get(guild, []), **kwargs)
+        if kwargs.keys() == {'id'}:
+            msg = self._get_by_id(kwargs['id'])
+        else:
+            msg = utils.get(
+                [
+                    self._messages[mid][0]
+                    for mid in self._guilds.get(guild, ())
+                ], **kwargs
+            )
+            if msg is not None:
+                msg = self._get_by_id(msg.id)
+
+        if msg is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return msg
+
+    def _get_by_id(
+        self,
+        msg_id: int
+    ) -> Optional[Any]:
+        entry = self._messages.get(msg_id)
+        if entry is None:
+            return None
+        msg, guild, expires, _size = entry
+        if expires < time.monotonic():
+            self._pop(msg_id)
+            self.expirations += 1
+            return None
+        self._messages.move_to_end(msg_id)
+        self._guilds[guild].move_to_end(msg_id)
+        return msg
 
     async def remove(
         self,
         msg_id: int,
         guild: int
     ) -> bool:
-        status = False
-        remove_index = None
-        for x, msg in enumerate(self._messages.get(guild, [])):
-            if msg.id == msg_id:
-                remove_index = x
-        if remove_index is not None:
-            self._messages[guild].pop(remove_index)
-            status = True
-        return status
+        return self._pop(msg_id) is not None
+
+    def clear(self) -> None:
+        self._messages.clear()
+        self._guilds.clear()
+        self._bytes = 0
+
+    def clear_guild(
+        self,
+        guild: int
+    ) -> None:
+        for msg_id in list(self._guilds.get(guild, ())):
+            self._pop(msg_id)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._messages),
+            'max_size': self.max_size,
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'guilds': len(self._guilds),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
 
     async def set_listeners(
         self,
@@ -191,6 +439,615 @@ class BotCache(aobject):
                 await self.remove(id, payload.guild_id)
 
 
+class KnownRows:
+    """A short lived record of rows that are known to exist, so
+    that check_or_create_existence can skip the database for
+    users that react often. Entries expire after `ttl` seconds
+    in case a row gets removed some other way."""
+    def __init__(
+        self,
+        ttl: float = 600,
+        max_size: int = 100000
+    ) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self._expires = {}
+
+    def __contains__(
+        self,
+        key: tuple
+    ) -> bool:
+        expires = self._expires.get(key)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del self._expires[key]
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+    def add(
+        self,
+        key: tuple
+    ) -> None:
+        now = time.monotonic()
+        if len(self._expires) >= self.max_size:
+            self._expires = {
+                k: e for k, e in self._expires.items() if e >= now
+            }
+            if len(self._expires) >= self.max_size:
+                self._expires = {}
+        self._expires[key] = now + self.ttl
+
+    def discard(
+        self,
+        key: tuple
+    ) -> None:
+        self._expires.pop(key, None)
+
+
+class EmbedCache:
+    """LRU cache of the embeds rendered for starboard messages.
+
+    Entries are keyed by the original message's id and only
+    returned while its `edited_at` still matches, so an edit
+    invalidates the entry even if the edit event is missed. One
+    entry is shared by every starboard the message is on."""
+    def __init__(
+        self,
+        max_size: int = 5000
+    ) -> None:
+        self.max_size = max_size
+        # {message_id: (edited_at, embed)}
+        self._embeds = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._embeds)
+
+    def get(
+        self,
+        message: Any
+    ) -> Optional[Any]:
+        entry = self._embeds.get(message.id)
+        if entry is None or entry[0] != message.edited_at:
+            self.misses += 1
+            return None
+        self._embeds.move_to_end(message.id)
+        self.hits += 1
+        return entry[1]
+
+    def put(
+        self,
+        message: Any,
+        embed: Any
+    ) -> None:
+        self._embeds[message.id] = (message.edited_at, embed)
+        self._embeds.move_to_end(message.id)
+        while len(self._embeds) > self.max_size:
+            self._embeds.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(
+        self,
+        message_id: int
+    ) -> None:
+        if self._embeds.pop(message_id, None) is not None:
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._embeds.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._embeds),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations
+        }
+
+
+class MessageLinks:
+    """Maps starboard messages to the original message they copy,
+    and originals to their copies on each starboard.
+
+    Message ids never change, so a resolved original is kept until
+    it falls out of the LRU. The copies of an original are loaded
+    with one query the first time they are needed and then kept up
+    to date by update_message/handle_starboard, which are the only
+    places that create or remove starboard messages."""
+    def __init__(
+        self,
+        max_size: int = 50000
+    ) -> None:
+        self.max_size = max_size
+        # {message_id: (orig_message_id, orig_channel_id)}
+        self._origs = OrderedDict()
+        # {orig_message_id: {starboard_id: [sb_message_id, points]}}
+        self._copies = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._origs) + len(self._copies)
+
+    def _put(
+        self,
+        store: OrderedDict,
+        key: int,
+        value: Any
+    ) -> None:
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > self.max_size:
+            store.popitem(last=False)
+
+    def cached(
+        self,
+        message_id: int
+    ) -> Optional[Tuple[int, Optional[int]]]:
+        """Returns what resolve() would, if it doesn't need a query"""
+        result = self._origs.get(int(message_id))
+        if result is not None:
+            self._origs.move_to_end(int(message_id))
+        return result
+
+    async def resolve(
+        self,
+        conn: CustomConn,
+        message_id: int
+    ) -> Tuple[int, Optional[int]]:
+        get_message = \
+            """SELECT messages.is_orig, messages.channel_id,
+            orig.id AS orig_id, orig.channel_id AS orig_channel_id
+            FROM messages
+            LEFT JOIN messages orig ON orig.id=messages.orig_message_id
+            WHERE messages.id=$1"""
+
+        message_id = int(message_id)
+        result = self._origs.get(message_id)
+        if result is not None:
+            self._origs.move_to_end(message_id)
+            return result
+
+        sql_message = await conn.fetchrow(get_message, message_id)
+        if sql_message is None:
+            # not cached, since the message may be created later
+            return message_id, None
+        if sql_message['is_orig'] is True:
+            result = (message_id, sql_message['channel_id'])
+        else:
+            result = (
+                sql_message['orig_id'],
+                sql_message['orig_channel_id']
+            )
+        self._put(self._origs, message_id, result)
+        return result
+
+    async def copies(
+        self,
+        conn: CustomConn,
+        orig_message_id: int
+    ) -> Dict[int, List[int]]:
+        get_copies = \
+            """SELECT id, channel_id, points FROM messages
+            WHERE orig_message_id=$1"""
+
+        orig_message_id = int(orig_message_id)
+        links = self._copies.get(orig_message_id)
+        if links is not None:
+            self._copies.move_to_end(orig_message_id)
+            return links
+
+        rows = await conn.fetch(get_copies, orig_message_id)
+        # a copy may have been added while the query was running
+        links = self._copies.get(orig_message_id, {})
+        for r in rows:
+            links.setdefault(
+                r['channel_id'], [r['id'], r['points']]
+            )
+        self._put(self._copies, orig_message_id, links)
+        return links
+
+    async def get_copy(
+        self,
+        conn: CustomConn,
+        orig_message_id: int,
+        starboard_id: int
+    ) -> Optional[List[int]]:
+        """Returns [sb_message_id, points] or None"""
+        links = await self.copies(conn, orig_message_id)
+        return links.get(int(starboard_id))
+
+    def add_copy(
+        self,
+        orig_message_id: int,
+        orig_channel_id: int,
+        starboard_id: int,
+        sb_message_id: int
+    ) -> None:
+        orig_message_id = int(orig_message_id)
+        self._put(
+            self._origs, int(sb_message_id),
+            (orig_message_id, int(orig_channel_id))
+        )
+        links = self._copies.get(orig_message_id)
+        if links is not None:
+            links[int(starboard_id)] = [int(sb_message_id), None]
+
+    def remove_copy(
+        self,
+        orig_message_id: int,
+        starboard_id: int
+    ) -> None:
+        links = self._copies.get(int(orig_message_id))
+        if links is None:
+            return
+        link = links.pop(int(starboard_id), None)
+        if link is not None:
+            self._origs.pop(link[0], None)
+
+    def set_points(
+        self,
+        orig_message_id: int,
+        starboard_id: int,
+        points: int
+    ) -> None:
+        links = self._copies.get(int(orig_message_id))
+        if links is None:
+            return
+        link = links.get(int(starboard_id))
+        if link is not None:
+            link[1] = points
+
+    def clear(self) -> None:
+        self._origs.clear()
+        self._copies.clear()
+
+
+class PrefixStore:
+    """Command prefixes of every guild, loaded in bulk on startup
+    so that resolving the prefix of a message never touches the
+    database.
+
+    get() returns the prefixes in the order they were added, which
+    is what users see. matcher() returns the same prefixes sorted
+    longest first. discord.py uses the first prefix that matches,
+    so `sb!!` has to be tried before `sb!`."""
+    def __init__(self) -> None:
+        # {guild_id: (prefixes, prefixes sorted longest first)}
+        self._prefixes: Dict[int, Tuple[Tuple[str, ...], ...]] = {}
+
+    def __len__(self) -> int:
+        return len(self._prefixes)
+
+    def __contains__(
+        self,
+        guild_id: int
+    ) -> bool:
+        return int(guild_id) in self._prefixes
+
+    @staticmethod
+    def _compile(
+        prefixes: List[str]
+    ) -> Tuple[Tuple[str, ...], ...]:
+        ordered = tuple(prefixes)
+        return ordered, tuple(sorted(set(ordered), key=len, reverse=True))
+
+    async def load(
+        self,
+        conn: CustomConn
+    ) -> None:
+        get_prefixes = \
+            """SELECT id, prefixes FROM guilds"""
+
+        rows = await conn.fetch(get_prefixes)
+        self._prefixes = {
+            r['id']: self._compile(r['prefixes'] or [])
+            for r in rows
+        }
+
+    def get(
+        self,
+        guild_id: int
+    ) -> Optional[Tuple[str, ...]]:
+        compiled = self._prefixes.get(int(guild_id))
+        return compiled[0] if compiled is not None else None
+
+    def matcher(
+        self,
+        guild_id: int
+    ) -> Optional[Tuple[str, ...]]:
+        compiled = self._prefixes.get(int(guild_id))
+        return compiled[1] if compiled is not None else None
+
+    def set(
+        self,
+        guild_id: int,
+        prefixes: List[str]
+    ) -> None:
+        self._prefixes[int(guild_id)] = self._compile(prefixes)
+
+    def match(
+        self,
+        guild_id: int,
+        content: str
+    ) -> Optional[str]:
+        for prefix in self.matcher(guild_id) or ():
+            if content.startswith(prefix):
+                return prefix
+        return None
+
+
+class StarboardFilter:
+    """The channel and role blacklists/whitelists of a starboard,
+    compiled into sets.
+
+    A channel whitelist overrides the channel blacklist. For
+    roles, members with a whitelisted role are always allowed;
+    otherwise they are blocked if they have a blacklisted role,
+    or if there is a role whitelist but no role blacklist."""
+    __slots__ = ('role_bl', 'role_wl', 'channel_bl', 'channel_wl')
+
+    def __init__(
+        self,
+        rolebl: List[apg.Record],
+        channelbl: List[apg.Record]
+    ) -> None:
+        self.role_bl = frozenset(
+            r['role_id'] for r in rolebl if not r['is_whitelist']
+        )
+        self.role_wl = frozenset(
+            r['role_id'] for r in rolebl if r['is_whitelist']
+        )
+        self.channel_bl = frozenset(
+            c['channel_id'] for c in channelbl if not c['is_whitelist']
+        )
+        self.channel_wl = frozenset(
+            c['channel_id'] for c in channelbl if c['is_whitelist']
+        )
+
+    @property
+    def has_roles(self) -> bool:
+        return bool(self.role_bl or self.role_wl)
+
+    def channel_blocked(
+        self,
+        channel_id: int
+    ) -> bool:
+        if self.channel_wl:
+            return channel_id not in self.channel_wl
+        return channel_id in self.channel_bl
+
+    def member_blocked(
+        self,
+        role_ids: Iterable[int]
+    ) -> bool:
+        if not self.has_roles:
+            return False
+        role_ids = set(role_ids)
+        if not self.role_wl.isdisjoint(role_ids):
+            return False
+        if not self.role_bl:
+            return True
+        return not self.role_bl.isdisjoint(role_ids)
+
+    def blocked_members(
+        self,
+        members: Iterable[Any]
+    ) -> List[Any]:
+        """Returns the members in `members` that are blocked"""
+        if not self.has_roles:
+            return []
+        return [
+            m for m in members
+            if self.member_blocked(r.id for r in m.roles)
+        ]
+
+
+# used for starboards without any blacklist or whitelist
+NO_FILTER = StarboardFilter([], [])
+
+
+class GuildConfig:
+    """The starboard/autostar configuration of a single guild.
+
+    Everything except prefixes is grouped by the id of the
+    starboard or aschannel it belongs to. emoji_index maps each
+    sbemoji name to {starboard_id: is_downvote} so that the
+    reaction handlers can match an emoji with a single lookup."""
+    __slots__ = (
+        'guild_id', 'starboards', 'sbemojis', 'channelbl', 'rolebl',
+        'aschannels', 'asemojis', 'prefixes', 'emoji_index',
+        'sbemoji_names', 'filters'
+    )
+
+    def __init__(
+        self,
+        guild_id: int,
+        starboards: List[apg.Record],
+        sbemojis: List[apg.Record],
+        channelbl: List[apg.Record],
+        rolebl: List[apg.Record],
+        aschannels: List[apg.Record],
+        asemojis: List[apg.Record],
+        prefixes: Optional[List[str]]
+    ) -> None:
+        self.guild_id = guild_id
+        self.starboards = {s['id']: s for s in starboards}
+        self.sbemojis = self._group(sbemojis, 'starboard_id')
+        self.channelbl = self._group(channelbl, 'starboard_id')
+        self.rolebl = self._group(rolebl, 'starboard_id')
+        self.aschannels = {a['id']: a for a in aschannels}
+        self.asemojis = self._group(asemojis, 'aschannel_id')
+        self.prefixes = prefixes
+
+        self.emoji_index = {}
+        for e in sbemojis:
+            self.emoji_index.setdefault(e['name'], {})[
+                e['starboard_id']
+            ] = e['is_downvote']
+        self.sbemoji_names = {
+            sid: frozenset(e['name'] for e in emojis)
+            for sid, emojis in self.sbemojis.items()
+        }
+        self.filters = {
+            sid: StarboardFilter(
+                self.rolebl.get(sid, []), self.channelbl.get(sid, [])
+            )
+            for sid in set(self.rolebl) | set(self.channelbl)
+        }
+
+    @staticmethod
+    def _group(
+        rows: List[apg.Record],
+        key: str
+    ) -> Dict[int, List[apg.Record]]:
+        grouped = {}
+        for row in rows:
+            grouped.setdefault(row[key], []).append(row)
+        return grouped
+
+    @property
+    def all_sbemojis(self) -> List[apg.Record]:
+        return [e for emojis in self.sbemojis.values() for e in emojis]
+
+    def is_sbemoji(
+        self,
+        name: str
+    ) -> bool:
+        return name in self.emoji_index
+
+    def emoji_starboards(
+        self,
+        name: str
+    ) -> Dict[int, bool]:
+        """Returns {starboard_id: is_downvote} for every
+        starboard that uses this emoji"""
+        return self.emoji_index.get(name, {})
+
+    def starboard_filter(
+        self,
+        starboard_id: int
+    ) -> StarboardFilter:
+        return self.filters.get(starboard_id, NO_FILTER)
+
+
+class GuildConfigCache:
+    """Caches a GuildConfig per guild so that the reaction
+    handlers don't have to query the config tables on every
+    event. Anything that writes to starboards, sbemojis,
+    channelbl, rolebl, aschannels, asemojis or guilds.prefixes
+    must call invalidate() afterwards."""
+    def __init__(
+        self,
+        db: 'Database'
+    ) -> None:
+        self.db = db
+        self._configs = {}
+        # bumped on every invalidate() so that a load which raced
+        # with a write doesn't store stale data
+        self._generations = {}
+        # {guild_id: (generation, task)}, for loads in progress
+        self._loading = {}
+
+    async def get(
+        self,
+        guild_id: int
+    ) -> GuildConfig:
+        guild_id = int(guild_id)
+        config = self._configs.get(guild_id)
+        if config is not None:
+            return config
+
+        # callers that miss at the same time share one load, unless
+        # the guild was invalidated after that load started
+        generation = self._generations.get(guild_id, 0)
+        loading = self._loading.get(guild_id)
+        if loading is None or loading[0] != generation:
+            loading = (generation, asyncio.ensure_future(
+                self._load_and_store(guild_id, generation)
+            ))
+            self._loading[guild_id] = loading
+        # shield so that a cancelled caller doesn't cancel the
+        # load for everyone else waiting on it
+        return await asyncio.shield(loading[1])
+
+    async def _load_and_store(
+        self,
+        guild_id: int,
+        generation: int
+    ) -> GuildConfig:
+        try:
+            config = await self._load(guild_id)
+            if self._generations.get(guild_id, 0) == generation:
+                self._configs[guild_id] = config
+            return config
+        finally:
+            if self._loading.get(guild_id, (None,))[0] == generation:
+                del self._loading[guild_id]
+
+    def invalidate(
+        self,
+        guild_id: int
+    ) -> None:
+        guild_id = int(guild_id)
+        self._configs.pop(guild_id, None)
+        self._generations[guild_id] = \
+            self._generations.get(guild_id, 0) + 1
+
+    def clear(self) -> None:
+        for guild_id in list(self._configs):
+            self.invalidate(guild_id)
+
+    async def _load(
+        self,
+        guild_id: int
+    ) -> GuildConfig:
+        get_starboards = \
+            """SELECT * FROM starboards WHERE guild_id=$1"""
+        get_sbemojis = \
+            """SELECT * FROM sbemojis WHERE starboard_id IN (
+                SELECT id FROM starboards WHERE guild_id=$1
+            )"""
+        get_channelbl = \
+            """SELECT * FROM channelbl WHERE guild_id=$1"""
+        get_rolebl = \
+            """SELECT * FROM rolebl WHERE guild_id=$1"""
+        get_aschannels = \
+            """SELECT * FROM aschannels WHERE guild_id=$1"""
+        get_asemojis = \
+            """SELECT * FROM asemojis WHERE aschannel_id IN (
+                SELECT id FROM aschannels WHERE guild_id=$1
+            )"""
+        get_prefixes = \
+            """SELECT prefixes FROM guilds WHERE id=$1"""
+
+        async with self.db.acquire() as conn:
+            async with conn.transaction():
+                starboards = await conn.fetch(get_starboards, guild_id)
+                sbemojis = await conn.fetch(get_sbemojis, guild_id)
+                channelbl = await conn.fetch(get_channelbl, guild_id)
+                rolebl = await conn.fetch(get_rolebl, guild_id)
+                aschannels = await conn.fetch(get_aschannels, guild_id)
+                asemojis = await conn.fetch(get_asemojis, guild_id)
+                prefixes = await conn.fetchval(get_prefixes, guild_id)
+
+        return GuildConfig(
+            guild_id, starboards, sbemojis, channelbl, rolebl,
+            aschannels, asemojis,
+            list(prefixes) if prefixes is not None else None
+        )
+
+
 class CommonSql(aobject):
     async def __init__(
         self,
@@ -257,7 +1114,8 @@ class CommonSql(aobject):
             await conn.prepare(
                 """INSERT INTO reactions (guild_id,
                 user_id, message_id, name)
-                VALUES ($1,$2,$3,$4)"""
+                VALUES ($1,$2,$3,$4)
+                ON CONFLICT (message_id, user_id, name) DO NOTHING"""
             )
 
         self.update_starboard = \
@@ -274,31 +1132,433 @@ class CommonSql(aobject):
             )
 
 
+class SnowflakeConversion:
+    """Finishes converting the columns in SNOWFLAKE_COLUMNS from
+    numeric to bigint while the bot is running.
+
+    Migration 2 only adds a bigint copy of each column, kept in sync
+    by a trigger. This runs in the background after startup and:
+    1. backfills the copies in small batches
+    2. validates their NOT NULL checks and builds a copy of every
+       index that uses them, concurrently
+    3. swaps the copies in and drops the numeric columns, in one
+       transaction that only changes the catalog
+    4. validates the foreign keys, which are added back NOT VALID
+
+    Each step can be interrupted and is picked up again on the next
+    start. An advisory lock keeps other processes from working on it
+    at the same time. Those processes should be restarted after the
+    swap: each statement they prepared before it fails once."""
+    BATCH_SIZE = 5000
+    # pause between batches so that the backfill doesn't compete
+    # with the bot for the database
+    BATCH_DELAY = 0.05
+    # the swap gives up on its locks after this long, and tries
+    # again later, rather than holding up everything queued behind
+    # it
+    LOCK_TIMEOUT = '2s'
+    SWAP_ATTEMPTS = 30
+
+    def __init__(
+        self,
+        db: 'Database'
+    ) -> None:
+        self.db = db
+        self.stage = 'waiting'
+        self.backfilled = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+        self._task.add_done_callback(self._done)
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    def _done(
+        self,
+        task: asyncio.Task
+    ) -> None:
+        if task.cancelled():
+            return
+        e = task.exception()
+        if e is not None:
+            self.stage = f'failed during {self.stage}'
+            traceback.print_exception(type(e), e, e.__traceback__)
+
+    async def run(self) -> None:
+        try_lock = \
+            """SELECT pg_try_advisory_lock(hashtext('snowflakes_to_bigint'))"""
+
+        # a connection of its own, since index builds and the
+        # backfill take a while
+        conn = (await self.db.make_connection()).realcon
+        try:
+            # released when the connection closes
+            if not await conn.fetchval(try_lock):
+                self.stage = 'running in another process'
+                return
+            shadows = await self._shadow_columns(conn)
+            if shadows:
+                self.stage = 'backfill'
+                for table, columns in shadows.items():
+                    await self._backfill(conn, table, columns)
+                self.stage = 'indexes'
+                for table, columns in shadows.items():
+                    await self._validate_checks(conn, table)
+                    await self._build_indexes(conn, table, columns)
+                self.stage = 'swap'
+                await self._swap(conn, shadows)
+                print("Swapped the id columns to bigint")
+                # statements prepared before the swap expect numeric
+                await self.db.conn.realcon.reload_schema_state()
+                if self.db.pool is not None:
+                    await self.db.pool.expire_connections()
+            self.stage = 'validate'
+            await self._validate_foreign_keys(conn)
+            self.stage = 'done'
+        finally:
+            await conn.close()
+
+    async def _shadow_columns(
+        self,
+        conn: apg.Connection
+    ) -> Dict[str, List[str]]:
+        """Returns {table: [column]} for the columns that still
+        have a bigint copy waiting to be swapped in"""
+        get_shadows = \
+            """SELECT table_name, column_name
+            FROM information_schema.columns
+            WHERE table_schema='public'
+            AND column_name LIKE '%\\_bigint'"""
+
+        found = {
+            (r['table_name'], r['column_name'])
+            for r in await conn.fetch(get_shadows)
+        }
+        shadows = {}
+        for table, columns in SNOWFLAKE_COLUMNS.items():
+            columns = [c for c in columns if (table, f'{c}_bigint') in found]
+            if columns:
+                shadows[table] = columns
+        return shadows
+
+    async def _backfill(
+        self,
+        conn: apg.Connection,
+        table: str,
+        columns: List[str]
+    ) -> None:
+        has_id = \
+            """SELECT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema='public'
+                AND table_name=$1 AND column_name='id'
+            )"""
+        copy = ", ".join(f"{c}_bigint={table}.{c}" for c in columns)
+
+        if not await conn.fetchval(has_id, table):
+            # only the blacklist tables, which are small enough to
+            # do at once
+            await conn.execute(f"UPDATE {table} SET {copy}")
+            return
+
+        update_batch = \
+            f"""WITH batch AS (
+                SELECT id FROM {table} WHERE id>$1
+                ORDER BY id LIMIT $2
+            )
+            UPDATE {table} SET {copy}
+            FROM batch WHERE {table}.id=batch.id
+            RETURNING {table}.id"""
+
+        # every id is positive, serial or snowflake
+        last_id = -1
+        while True:
+            rows = await conn.fetch(update_batch, last_id, self.BATCH_SIZE)
+            if not rows:
+                break
+            last_id = max(r['id'] for r in rows)
+            self.backfilled += len(rows)
+            await asyncio.sleep(self.BATCH_DELAY)
+        print(f"Backfilled bigint ids for {table}")
+
+    async def _validate_checks(
+        self,
+        conn: apg.Connection,
+        table: str
+    ) -> None:
+        get_checks = \
+            """SELECT conname FROM pg_constraint
+            WHERE conrelid=$1::regclass
+            AND contype='c' AND NOT convalidated
+            AND conname LIKE '%\\_bigint\\_not\\_null'"""
+
+        for r in await conn.fetch(get_checks, table):
+            # only blocks schema changes, not reads or writes
+            await conn.execute(
+                f'ALTER TABLE {table} VALIDATE CONSTRAINT "{r["conname"]}"'
+            )
+
+    async def _build_indexes(
+        self,
+        conn: apg.Connection,
+        table: str,
+        columns: List[str]
+    ) -> None:
+        get_indexes = \
+            """SELECT c.relname AS name, i.indisunique, i.indisvalid,
+            pg_get_expr(i.indpred, i.indrelid) AS predicate,
+            ARRAY(
+                SELECT a.attname
+                FROM unnest(i.indkey::int2[]) WITH ORDINALITY AS k(n, x)
+                JOIN pg_attribute a
+                ON a.attrelid=i.indrelid AND a.attnum=k.n
+                ORDER BY k.x
+            ) AS columns
+            FROM pg_index i
+            JOIN pg_class c ON c.oid=i.indexrelid
+            WHERE i.indrelid=$1::regclass"""
+
+        indexes = {r['name']: r for r in await conn.fetch(get_indexes, table)}
+        for name, index in indexes.items():
+            if name.endswith('_bigint') or \
+                    not set(index['columns']) & set(columns):
+                continue
+            copy = indexes.get(f'{name}_bigint')
+            if copy is not None:
+                if copy['indisvalid']:
+                    continue
+                # left behind by a build that was interrupted
+                await conn.execute(
+                    f"DROP INDEX CONCURRENTLY IF EXISTS {name}_bigint"
+                )
+            create_index = \
+                "CREATE {}INDEX CONCURRENTLY {}_bigint ON {} ({}){}".format(
+                    "UNIQUE " if index['indisunique'] else "",
+                    name, table, ", ".join(
+                        f"{c}_bigint" if c in columns else c
+                        for c in index['columns']
+                    ),
+                    # none of the partial indexes filter on an id
+                    f" WHERE {index['predicate']}"
+                    if index['predicate'] else ""
+                )
+            await conn.execute(create_index)
+
+    async def _swap(
+        self,
+        conn: apg.Connection,
+        shadows: Dict[str, List[str]]
+    ) -> None:
+        for attempt in range(self.SWAP_ATTEMPTS):
+            try:
+                async with conn.transaction():
+                    await conn.execute(
+                        f"SET LOCAL lock_timeout='{self.LOCK_TIMEOUT}'"
+                    )
+                    await self._swap_columns(conn, shadows)
+                return
+            except apg.exceptions.LockNotAvailableError:
+                await asyncio.sleep(min(2**attempt, 60))
+        raise Exception("Couldn't lock the tables to swap the id columns")
+
+    async def _swap_columns(
+        self,
+        conn: apg.Connection,
+        shadows: Dict[str, List[str]]
+    ) -> None:
+        get_foreign_keys = \
+            """SELECT conrelid::regclass::text AS tbl, conname,
+            pg_get_constraintdef(oid) AS def
+            FROM pg_constraint
+            WHERE contype='f'
+            AND connamespace='public'::regnamespace"""
+        get_primary_key = \
+            """SELECT conname, ARRAY(
+                SELECT attname FROM pg_attribute
+                WHERE attrelid=conrelid AND attnum=ANY(conkey)
+            ) AS columns
+            FROM pg_constraint
+            WHERE conrelid=$1::regclass AND contype='p'"""
+        get_checks = \
+            """SELECT conname FROM pg_constraint
+            WHERE conrelid=$1::regclass AND contype='c'
+            AND conname LIKE '%\\_bigint\\_not\\_null'"""
+        get_index_copies = \
+            """SELECT c.relname AS name FROM pg_index i
+            JOIN pg_class c ON c.oid=i.indexrelid
+            WHERE i.indrelid=$1::regclass
+            AND c.relname LIKE '%\\_bigint'"""
+
+        foreign_keys = await conn.fetch(get_foreign_keys)
+        tables = sorted(
+            set(SNOWFLAKE_COLUMNS) | {fk['tbl'] for fk in foreign_keys}
+        )
+        # everything below only changes the catalog, so the tables
+        # are locked for milliseconds
+        await conn.execute(
+            f"LOCK TABLE {', '.join(tables)} IN ACCESS EXCLUSIVE MODE"
+        )
+
+        # the keys point at the columns that are about to be dropped
+        for fk in foreign_keys:
+            await conn.execute(
+                f'ALTER TABLE {fk["tbl"]} DROP CONSTRAINT "{fk["conname"]}"'
+            )
+
+        for table, columns in shadows.items():
+            primary_key = await conn.fetchrow(get_primary_key, table)
+            checks = [
+                r['conname'] for r in await conn.fetch(get_checks, table)
+            ]
+            copies = [
+                r['name'] for r in await conn.fetch(get_index_copies, table)
+            ]
+
+            await conn.execute(
+                f"DROP TRIGGER IF EXISTS {table}_sync_bigint ON {table}"
+            )
+            await conn.execute(
+                f"DROP FUNCTION IF EXISTS {table}_sync_bigint()"
+            )
+            # also drops every index and the primary key on them
+            await conn.execute(
+                f"ALTER TABLE {table} " + ", ".join(
+                    f"DROP COLUMN {c}" for c in columns
+                )
+            )
+            for c in columns:
+                await conn.execute(
+                    f"ALTER TABLE {table} RENAME COLUMN {c}_bigint TO {c}"
+                )
+            for check in checks:
+                column = check[len(table)+1:-len('_bigint_not_null')]
+                # the validated check means this doesn't scan the table
+                await conn.execute(
+                    f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL"
+                )
+                await conn.execute(
+                    f'ALTER TABLE {table} DROP CONSTRAINT "{check}"'
+                )
+            for copy in copies:
+                await conn.execute(
+                    f"ALTER INDEX {copy} RENAME TO {copy[:-len('_bigint')]}"
+                )
+            if primary_key is not None and \
+                    set(primary_key['columns']) & set(columns):
+                name = primary_key['conname']
+                await conn.execute(
+                    f'ALTER TABLE {table} ADD CONSTRAINT "{name}" '
+                    f'PRIMARY KEY USING INDEX "{name}"'
+                )
+
+        for fk in foreign_keys:
+            await conn.execute(
+                f'ALTER TABLE {fk["tbl"]} '
+                f'ADD CONSTRAINT "{fk["conname"]}" {fk["def"]} NOT VALID'
+            )
+
+    async def _validate_foreign_keys(
+        self,
+        conn: apg.Connection
+    ) -> None:
+        get_unvalidated = \
+            """SELECT conrelid::regclass::text AS tbl, conname
+            FROM pg_constraint
+            WHERE contype='f' AND NOT convalidated
+            AND connamespace='public'::regnamespace"""
+
+        for fk in await conn.fetch(get_unvalidated):
+            # checks the existing rows without blocking writes
+            await conn.execute(
+                f'ALTER TABLE {fk["tbl"]} '
+                f'VALIDATE CONSTRAINT "{fk["conname"]}"'
+            )
+
+
 class Database:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        pool_min_size: int = 0,
+        pool_max_size: int = 0
+    ) -> None:
         self.lock = Lock()
         self.cooldowns = {
             'giving_stars': {}  # {user_id: cooldown_end_datetime}
         }
         self.conn = None
+        self.pool = None
+        self.pool_min_size = pool_min_size
+        self.pool_max_size = pool_max_size
         self.cache = None
         self.as_cache = None
+        self.config_cache = GuildConfigCache(self)
+        self.known_rows = KnownRows()
+        self.message_links = MessageLinks()
+        self.embed_cache = EmbedCache()
+        self.prefixes = PrefixStore()
+        self.snowflakes = SnowflakeConversion(self)
 
     async def open(
         self,
         bot: commands.Bot
     ) -> None:
         # self.q = await CommonSql()
-        await self._create_tables()
-        await self._apply_migrations()
+        await self._migrate()
         self.q = await CommonSql(await self.connect())
+        await self.prefixes.load(self.conn)
+        if self.pool_max_size > 0:
+            self.pool = await self.make_pool()
         self.cache = await BotCache(bot.event)
+        self.snowflakes.start()
+
+    async def close(self) -> None:
+        self.snowflakes.stop()
+        if self.conn is not None:
+            # flush whatever runtimes were recorded since the
+            # last periodic dump
+            try:
+                async with self.acquire() as conn:
+                    await conn.dump()
+            except Exception:
+                traceback.print_exc()
+        if self.pool is not None:
+            await self.pool.close()
+        if self.conn is not None:
+            await self.conn.realcon.close()
 
     async def connect(self) -> CustomConn:
         if self.conn is None:
             self.conn = await self.make_connection()
         return self.conn
 
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[CustomConn]:
+        """Yields a connection for a single operation.
+
+        If pooling is enabled, a connection is checked out of
+        the pool so that unrelated operations can run at the same
+        time. Otherwise this falls back to the global lock and the
+        single shared connection. Either way, don't nest acquire()
+        inside another acquire() or inside `db.lock`."""
+        if self.pool is None:
+            async with self.lock:
+                yield await self.connect()
+            return
+
+        async with self.pool.acquire() as realcon:
+            yield CustomConn(realcon, self.conn.stats)
+
+    async def make_pool(self) -> apg.pool.Pool:
+        return await apg.create_pool(
+            host='localhost', database='starboard',
+            user='starboard', password=db_pwd,
+            min_size=self.pool_min_size,
+            max_size=self.pool_max_size
+        )
+
     async def make_connection(self) -> CustomConn:
         conn = None
         try:
@@ -323,6 +1583,238 @@ class Database:
             d[col[0]] = row[idx]
         return d
 
+    def _migrations(
+        self
+    ) -> List[Tuple[int, str, Callable[[], Awaitable[None]]]]:
+        """The schema history, oldest first.
+
+        New schema changes get appended here with the next version
+        number. A migration that has already shipped must never be
+        edited, since databases that ran it will not run it again.
+        Version 1 is the schema as it was before versioning; every
+        statement in it is idempotent, so it is safe to run against
+        a database of any age."""
+        return [
+            (1, 'baseline', self._baseline),
+            (2, 'snowflakes_to_bigint', self._snowflakes_to_bigint),
+            (3, 'hot_path_indexes', self._hot_path_indexes),
+            (4, 'reaction_counts', self._reaction_counts),
+            (5, 'unique_reactions', self._unique_reactions),
+        ]
+
+    async def _migrate(self) -> None:
+        """Applies the migrations that this database hasn't seen yet.
+
+        When the schema is already current this costs one query.
+        Each migration runs in its own transaction together with the
+        row that records it. An advisory lock keeps two processes
+        that start at the same time from applying the same one."""
+        get_version = \
+            """SELECT COALESCE(MAX(version), 0) FROM schema_version"""
+        create_version_table = \
+            """CREATE TABLE IF NOT EXISTS schema_version (
+                version integer PRIMARY KEY,
+                name text NOT NULL,
+                applied_at timestamp NOT NULL DEFAULT now(),
+                duration real NOT NULL
+            )"""
+        lock_schema = \
+            """SELECT pg_advisory_xact_lock(hashtext('schema_version'))"""
+        insert_version = \
+            """INSERT INTO schema_version (version, name, duration)
+            VALUES ($1, $2, $3)"""
+
+        migrations = self._migrations()
+        latest = migrations[-1][0]
+
+        async with self.lock:
+            conn = (await self.connect()).realcon
+            try:
+                current = await conn.fetchval(get_version)
+            except apg.exceptions.UndefinedTableError:
+                await conn.execute(create_version_table)
+                current = 0
+
+            if current >= latest:
+                return
+
+            for version, name, migration in migrations:
+                if version <= current:
+                    continue
+                start = time.perf_counter()
+                async with conn.transaction():
+                    await conn.execute(lock_schema)
+                    if await conn.fetchval(get_version) >= version:
+                        continue
+                    await migration()
+                    duration = time.perf_counter() - start
+                    await conn.execute(
+                        insert_version, version, name, duration
+                    )
+                print(
+                    f"Applied migration {version} ({name}) "
+                    f"in {round(duration*1000, 2)} ms"
+                )
+
+    async def _baseline(self) -> None:
+        await self._create_tables()
+        await self._apply_migrations()
+
+    async def _snowflakes_to_bigint(self) -> None:
+        """Starts converting the columns that hold discord ids from
+        numeric to bigint, which is much cheaper to compare, hash
+        and index.
+
+        Changing a column's type rewrites the table while holding
+        an exclusive lock on it, so this only adds an empty bigint
+        copy of each column, which doesn't touch existing rows, and
+        a trigger that fills it in on insert and update.
+        SnowflakeConversion does the rest in the background."""
+        get_numeric_columns = \
+            """SELECT table_name, column_name, is_nullable
+            FROM information_schema.columns
+            WHERE table_schema='public' AND data_type='numeric'"""
+
+        conn = (await self.connect()).realcon
+        numeric = {
+            (r['table_name'], r['column_name']): r['is_nullable'] == 'YES'
+            for r in await conn.fetch(get_numeric_columns)
+        }
+
+        for table, columns in SNOWFLAKE_COLUMNS.items():
+            columns = [c for c in columns if (table, c) in numeric]
+            if not columns:
+                continue
+            changes = [f"ADD COLUMN {c}_bigint bigint" for c in columns]
+            # validated in the background, so that SET NOT NULL
+            # doesn't have to scan the table during the swap
+            changes += [
+                f"ADD CONSTRAINT {table}_{c}_bigint_not_null "
+                f"CHECK ({c}_bigint IS NOT NULL) NOT VALID"
+                for c in columns if not numeric[table, c]
+            ]
+            await conn.execute(f"ALTER TABLE {table} " + ", ".join(changes))
+            await conn.execute(
+                f"""CREATE OR REPLACE FUNCTION {table}_sync_bigint()
+                RETURNS trigger AS $$
+                BEGIN
+                    {" ".join(f"NEW.{c}_bigint := NEW.{c};" for c in columns)}
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql"""
+            )
+            # on every update, not just those that change an id: the
+            # NOT NULL checks apply to rows that are written before
+            # the backfill gets to them
+            await conn.execute(
+                f"""CREATE TRIGGER {table}_sync_bigint
+                BEFORE INSERT OR UPDATE ON {table}
+                FOR EACH ROW EXECUTE PROCEDURE {table}_sync_bigint()"""
+            )
+
+    async def _hot_path_indexes(self) -> None:
+        # keeps the member with the most xp if a member was
+        # created twice, so that (user_id, guild_id) can be unique
+        dedupe_members = \
+            """DELETE FROM members WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, row_number() OVER (
+                        PARTITION BY user_id, guild_id
+                        ORDER BY xp DESC, id
+                    ) AS n FROM members
+                ) AS ranked WHERE n > 1
+            )"""
+        members_unique_index = \
+            """CREATE UNIQUE INDEX IF NOT EXISTS members_user_guild
+            ON members(user_id, guild_id)"""
+        drop_member_uid_index = \
+            """DROP INDEX IF EXISTS member_uid"""
+        messages_orig_channel_index = \
+            """CREATE INDEX IF NOT EXISTS messages_orig_channel
+            ON messages(orig_message_id, channel_id)"""
+        drop_msg_orig_msg_id_index = \
+            """DROP INDEX IF EXISTS msg_id"""
+        channelbl_starboard_index = \
+            """CREATE INDEX IF NOT EXISTS channelbl_starboard
+            ON channelbl(starboard_id, is_whitelist)"""
+        rolebl_starboard_index = \
+            """CREATE INDEX IF NOT EXISTS rolebl_starboard
+            ON rolebl(starboard_id, is_whitelist)"""
+        asemojis_aschannel_index = \
+            """CREATE INDEX IF NOT EXISTS asemojis_aschannel_id
+            ON asemojis(aschannel_id)"""
+        votes_unexpired_index = \
+            """CREATE INDEX IF NOT EXISTS votes_unexpired
+            ON votes(expires) WHERE expired=False"""
+
+        await self._apply_migration(dedupe_members)
+        await self._create_index(members_unique_index)
+        # both are prefixes of the indexes above
+        await self._apply_migration(drop_member_uid_index)
+        await self._create_index(messages_orig_channel_index)
+        await self._apply_migration(drop_msg_orig_msg_id_index)
+        await self._create_index(channelbl_starboard_index)
+        await self._create_index(rolebl_starboard_index)
+        await self._create_index(asemojis_aschannel_index)
+        await self._create_index(votes_unexpired_index)
+
+    async def _reaction_counts(self) -> None:
+        reaction_counts_table = \
+            """CREATE TABLE IF NOT EXISTS reaction_counts (
+                message_id bigint NOT NULL,
+                name text NOT NULL,
+                count integer NOT NULL DEFAULT 0,
+
+                PRIMARY KEY (message_id, name),
+                FOREIGN KEY (message_id) REFERENCES messages (id)
+                    ON DELETE CASCADE
+            )"""
+        fill_reaction_counts = \
+            """INSERT INTO reaction_counts (message_id, name, count)
+            SELECT message_id, name, COUNT(*) FROM reactions
+            GROUP BY message_id, name
+            ON CONFLICT (message_id, name) DO UPDATE
+            SET count=EXCLUDED.count"""
+
+        await self._create_table(reaction_counts_table)
+        await self._apply_migration(fill_reaction_counts)
+
+    async def _unique_reactions(self) -> None:
+        # a reaction could be stored twice when two events for it
+        # were handled at the same time. The extra rows are removed,
+        # and taken off reaction_counts, so that the index can be
+        # unique and inserts can rely on it.
+        dedupe_reactions = \
+            """WITH removed AS (
+                DELETE FROM reactions WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, row_number() OVER (
+                            PARTITION BY message_id, user_id, name
+                            ORDER BY id
+                        ) AS n FROM reactions
+                    ) AS ranked WHERE n > 1
+                )
+                RETURNING message_id, name
+            )
+            UPDATE reaction_counts
+            SET count=GREATEST(reaction_counts.count-removed.n, 0)
+            FROM (
+                SELECT message_id, name, COUNT(*) AS n FROM removed
+                GROUP BY message_id, name
+            ) AS removed
+            WHERE reaction_counts.message_id=removed.message_id
+            AND reaction_counts.name=removed.name"""
+        reactions_unique_index = \
+            """CREATE UNIQUE INDEX IF NOT EXISTS reactions_message_user_name
+            ON reactions(message_id, user_id, name)"""
+        drop_delete_reaction_index = \
+            """DROP INDEX IF EXISTS delete_reaction"""
+
+        await self._apply_migration(dedupe_reactions)
+        await self._create_index(reactions_unique_index)
+        # same columns as the unique index
+        await self._apply_migration(drop_delete_reaction_index)
+
     async def _create_table(self, sql: str) -> None:
         conn = await self.connect()
         await conn.realcon.execute(sql)
@@ -376,8 +1868,11 @@ class Database:
             """ALTER TABLE starboards
             ADD COLUMN IF NOT EXISTS require_image
             BOOL NOT NULL DEFAULT False"""
+        sqlruntimes__addcolumn__buckets = \
+            """ALTER TABLE sqlruntimes
+            ADD COLUMN IF NOT EXISTS buckets
+            integer ARRAY NOT NULL DEFAULT '{}'"""
 
-        await self.lock.acquire()
         await self._apply_migration(messages__addcolumn__points)
         await self._apply_migration(guilds__addcolumn__prefixes)
         await self._apply_migration(deltable__prefixes)
@@ -390,7 +1885,7 @@ class Database:
         await self._apply_migration(members__addcolumn__autoredeem)
         await self._apply_migration(guilds__addcolumn__is_qa_on)
         await self._apply_migration(starboards__addcolumn__require_image)
-        self.lock.release()
+        await self._apply_migration(sqlruntimes__addcolumn__buckets)
 
     async def _create_tables(self) -> None:
         guilds_table = \
@@ -607,7 +2102,8 @@ class Database:
             """CREATE TABLE IF NOT EXISTS sqlruntimes (
                 sql TEXT PRIMARY KEY,
                 count integer NOT NULL DEFAULT 0,
-                time numeric NOT NULL DEFAULT 0
+                time numeric NOT NULL DEFAULT 0,
+                buckets integer ARRAY NOT NULL DEFAULT '{}'
             )"""
 
         delete_reaction_index = \
@@ -630,8 +2126,6 @@ class Database:
             """CREATE INDEX IF NOT EXISTS messages_guild_id
             ON messages(guild_id)"""
 
-        await self.lock.acquire()
-
         await self._create_table(guilds_table)
         await self._create_table(xproles_table)
         await self._create_table(posroles_table)
@@ -654,6 +2148,4 @@ class Database:
         await self._create_index(msg_orig_msg_id_index)
         await self._create_index(member_uid_index)
         await self._create_index(sbemojis_starboard_index)
-        await self._create_table(messages_guild_id_index)
-
-        self.lock.release()
+        await self._create_index(messages_guild_id_index)
@@ -0,0 +1,52 @@
+import asyncio
+import traceback
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class Debouncer:
+    """Collapses bursts of work for the same key.
+
+    The first call for a key runs right away. Any calls that come
+    in while it is running, or within `window` seconds after it
+    finished, are merged into a single trailing run that uses the
+    most recent callback. So a key is handled at most once per
+    window, and the last call is never dropped.
+    """
+    __slots__ = ('window', '_pending', '_tasks')
+
+    def __init__(self, window: float) -> None:
+        self.window = float(window)
+        self._pending: Dict[Hashable, Callable[[], Awaitable[Any]]] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def schedule(
+        self,
+        key: Hashable,
+        callback: Callable[[], Awaitable[Any]]
+    ) -> None:
+        self._pending[key] = callback
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._run(key))
+
+    async def _run(self, key: Hashable) -> None:
+        try:
+            while True:
+                callback = self._pending.pop(key)
+                try:
+                    await callback()
+                except Exception:
+                    traceback.print_exc()
+                await asyncio.sleep(self.window)
+                if key not in self._pending:
+                    break
+        finally:
+            self._tasks.pop(key, None)
+
+    def __repr__(self) -> str:
+        return (
+            f"<Debouncer window: {self.window} active: {len(self._tasks)} "
+            f"pending: {len(self._pending)}>"
+        )
@@ -1,7 +1,9 @@
 import datetime
 import re
 from itertools import compress
-from typing import Any, Iterable, List, Optional, Sequence, Tuple, Union
+from typing import (
+    Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+)
 
 import asyncpg
 import discord
@@ -12,11 +14,18 @@ from discord.ext import commands
 import bot_config
 import errors
 import functions
+import spool
 from api import tenor
 from cogs import starboard
 from database.database import Database  # for typehinting
 from paginators import disputils
 
+# spoilered attachments are re-uploaded to starboards from here
+attachment_spool = spool.AttachmentSpool(
+    getattr(bot_config, 'SPOOL_MAX_FILE_SIZE', 8 * 1024 * 1024),
+    getattr(bot_config, 'SPOOL_MAX_SIZE', 256 * 1024 * 1024)
+)
+
 
 async def can_manage_role(
     bot: commands.Bot,
@@ -38,8 +47,9 @@ async def needs_recount(
     bot: commands.Bot,
     message: discord.Message
 ) -> bool:
-    get_reactions = \
-        """SELECT * FROM reactions WHERE message_id=$1"""
+    get_total = \
+        """SELECT COALESCE(SUM(count), 0) FROM reaction_counts
+        WHERE message_id=$1"""
 
     if message is None:
         return False
@@ -58,13 +68,11 @@ async def needs_recount(
     if total == 0:  # Don't recount if the message doesn't have reactions
         return False
 
-    async with bot.db.lock:
-        conn = bot.db.conn
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
-            reactions = await conn.fetch(
-                get_reactions, message.id
+            sql_total = await conn.fetchval(
+                get_total, message.id
             )
-            sql_total = len(reactions)
 
     if sql_total < 0.5*total and total-sql_total > 2:
         # recount if the bot has logged less than 10% of the reactions
@@ -76,9 +84,6 @@ async def recount_reactions(
     bot: commands.Bot,
     message: discord.Message
 ) -> None:
-    check_reaction = \
-        """SELECT * FROM reactions WHERE
-        message_id=$1 AND name=$2 AND user_id=$3"""
     check_message = \
         """SELECT * FROM messages
         WHERE id=$1"""
@@ -90,7 +95,15 @@ async def recount_reactions(
     if message is None:
         return
 
-    # [{'user_id': user_id, 'name': name}, ...]
+    async with bot.db.acquire() as conn:
+        async with conn.transaction():
+            sql_m = await conn.fetchrow(
+                check_message, message.id
+            )
+    if sql_m and sql_m['is_orig'] is False:
+        return
+
+    # [(user, name), ...]
     # other values can be determined from the message object
     to_add = []
 
@@ -110,53 +123,87 @@ async def recount_reactions(
                 continue
             elif user.bot:
                 continue
-            to_add.append({
-                'user': user, 'name': name
-            })
+            to_add.append((user, name))
 
-    conn = bot.db.conn
+    await bulk_create_reactions(bot.db, message, to_add)
+
+    await starboard.handle_starboards(
+        bot.db, bot, message.id, message.channel, message,
+        message.guild, recount=True
+    )
 
-    async with bot.db.lock:
-        async with conn.transaction():
-            sql_m = await conn.fetchrow(
-                check_message, message.id
-            )
-            if sql_m and sql_m['is_orig'] is False:
-                print("No")
-                return
-            elif sql_m is None:
-                await bot.db.q.create_message.fetch(
-                    message.id, message.guild.id,
-                    message.author.id, None,
-                    message.channel.id, True,
-                    message.channel.is_nsfw()
-                )
 
-    for r in to_add:
-        await functions.check_or_create_existence(
-            bot,
-            guild_id=message.guild.id,
-            user=r['user'], do_member=True
+async def bulk_create_reactions(
+    db: Database,
+    message: discord.Message,
+    reactions: List[Tuple[Union[discord.User, discord.Member], str]]
+) -> None:
+    """Stores reactions on an original message using a few
+    set-based statements instead of one round trip per reaction.
+    The guild, users, members and the message itself are created
+    if they don't exist, and reactions that are already stored are
+    skipped. reaction_counts is updated in the same statement as
+    the reactions it counts."""
+    # reactions have no unique constraint to use ON CONFLICT
+    # with, so they use NOT EXISTS instead
+    create_guild = \
+        """INSERT INTO guilds (id) VALUES($1)
+        ON CONFLICT DO NOTHING
+        RETURNING id"""
+    create_users = \
+        """INSERT INTO users (id, is_bot)
+        SELECT * FROM unnest($1::bigint[], $2::bool[])
+        ON CONFLICT DO NOTHING"""
+    create_members = \
+        """INSERT INTO members (user_id, guild_id)
+        SELECT u.id, $2 FROM unnest($1::bigint[]) AS u(id)
+        ON CONFLICT (user_id, guild_id) DO NOTHING"""
+    create_message = \
+        """INSERT INTO messages (id, guild_id,
+        user_id, orig_message_id, channel_id,
+        is_orig, is_nsfw)
+        VALUES($1,$2,$3,$4,$5,$6,$7)
+        ON CONFLICT DO NOTHING"""
+    create_reactions = \
+        """WITH added AS (
+            INSERT INTO reactions (guild_id, user_id, message_id, name)
+            SELECT $1, r.user_id, $2, r.name
+            FROM unnest($3::bigint[], $4::text[]) AS r(user_id, name)
+            ON CONFLICT (message_id, user_id, name) DO NOTHING
+            RETURNING name
         )
+        INSERT INTO reaction_counts (message_id, name, count)
+        SELECT $2, name, COUNT(*) FROM added GROUP BY name
+        ON CONFLICT (message_id, name) DO UPDATE
+        SET count=reaction_counts.count+EXCLUDED.count"""
 
-        async with bot.db.lock:
-            async with conn.transaction():
-                sql_r = await conn.fetchrow(
-                    check_reaction, message.id, r['name'],
-                    r['user'].id
-                )
-                if sql_r is not None:
-                    continue
+    guild_id = message.guild.id
 
-                await bot.db.q.create_reaction.fetch(
-                    message.guild.id, (r['user']).id,
-                    message.id, r['name']
-                )
+    users = {message.author.id: message.author.bot}
+    for user, _name in reactions:
+        users[user.id] = user.bot
+    pairs = list({(user.id, name) for user, name in reactions})
 
-    await starboard.handle_starboards(
-        bot.db, bot, message.id, message.channel, message,
-        message.guild
-    )
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            new_guild = await conn.fetchval(create_guild, guild_id)
+            await conn.execute(
+                create_users, list(users), list(users.values())
+            )
+            await conn.execute(create_members, list(users), guild_id)
+            await conn.execute(
+                create_message, message.id, guild_id,
+                message.author.id, None, message.channel.id, True,
+                message.channel.is_nsfw()
+            )
+            if pairs:
+                await conn.execute(
+                    create_reactions, guild_id, message.id,
+                    [uid for uid, _name in pairs],
+                    [name for _uid, name in pairs]
+                )
+    if new_guild is not None:
+        db.config_cache.invalidate(guild_id)
 
 
 async def is_starboard_emoji(
@@ -169,28 +216,46 @@ async def is_starboard_emoji(
         emoji = str(emoji)
     else:
         emoji = [str(emo) for emo in emoji]
-    get_starboards = \
-        """SELECT * FROM starboards WHERE guild_id=$1"""
-    get_sbeemojis = \
-        """SELECT * FROM sbemojis WHERE starboard_id=any($1::numeric[])"""
 
-    async with db.lock:
-        conn = await db.connect()
-        async with conn.transaction():
-            starboards = await conn.fetch(get_starboards, guild_id)
-            sql_all_emojis = await conn.fetch(
-                get_sbeemojis, [starboard['id'] for starboard in starboards]
-            )
-            all_emojis = [e['name'] for e in sql_all_emojis]
+    config = await db.config_cache.get(guild_id)
     if not multiple:
-        return str(emoji) in all_emojis
+        return config.is_sbemoji(emoji)
     else:
-        return [emo in all_emojis for emo in emoji]
+        return [config.is_sbemoji(emo) for emo in emoji]
 
 
 async def get_embed_from_message(
-    message: discord.Message
+    db: Database,
+    message: discord.Message,
+    with_files: bool = True
 ) -> Tuple[discord.Embed, List[discord.File]]:
+    """Returns the starboard embed for `message` and the spoiler
+    attachments to send along with it. The embed comes from
+    db.embed_cache when possible and must not be modified.
+    Spoilers that are too big to forward are only linked in the
+    embed. Pass `with_files=False` when only the embed is needed."""
+    extra_attachments = []
+    for attachment in message.attachments:
+        if with_files and attachment.is_spoiler():
+            file = await attachment_spool.get_file(attachment)
+            if file is not None:
+                extra_attachments.append(file)
+    embed = db.embed_cache.get(message)
+    if embed is None:
+        embed, complete = await render_embed(message)
+        # embeds with a missing gif aren't kept, so that a later
+        # render can pick it up once tenor's cache of the failed
+        # lookup expires
+        if complete:
+            db.embed_cache.put(message, embed)
+    return embed, extra_attachments
+
+
+async def render_embed(
+    message: discord.Message
+) -> Tuple[discord.Embed, bool]:
+    """Returns the starboard embed for `message`, and whether every
+    tenor gif in it was found"""
     nsfw = message.channel.is_nsfw()
     embed = discord.Embed(
         title="NSFW" if nsfw else discord.Embed.Empty, colour=bot_config.COLOR
@@ -202,11 +267,7 @@ async def get_embed_from_message(
     msg_attachments = message.attachments
     urls = []
 
-    extra_attachments = []
-
     for attachment in msg_attachments:
-        if attachment.is_spoiler():
-            extra_attachments.append(await attachment.to_file())
         urls.append({
             'name': attachment.filename, 'display_url': attachment.url,
             'url': attachment.url, 'type': 'upload',
@@ -215,6 +276,16 @@ async def get_embed_from_message(
 
     e = discord.embeds._EmptyEmbed
 
+    # look up every tenor gif in the message at once
+    gif_ids = [
+        tenor.get_gif_id(msg_embed.url) for msg_embed in message.embeds
+        if msg_embed.type == 'gifv' and type(msg_embed.url) != e
+    ]
+    gif_urls = await tenor.get_gif_urls(
+        gifid for gifid in gif_ids if gifid is not None
+    )
+    complete = None not in gif_urls.values()
+
     for msg_embed in message.embeds:
         if msg_embed.type == 'rich':
             fields = [
@@ -254,11 +325,12 @@ async def get_embed_from_message(
                     'url': msg_embed.url, 'type': 'image', 'spoiler': False
                 })
         elif msg_embed.type == 'gifv':
-            gifid = tenor.get_gif_id(msg_embed.url)
-            if gifid is None:
+            gifid = tenor.get_gif_id(msg_embed.url) \
+                if type(msg_embed.url) != e else None
+            display_url = gif_urls[gifid] if gifid is not None else None
+            if display_url is None:
+                # not a tenor gif, or tenor couldn't find it
                 display_url = msg_embed.thumbnail.url
-            else:
-                display_url = await tenor.get_gif_url(gifid)
             if msg_embed.url != discord.Embed.Empty:
                 urls.append({
                     'name': 'GIF', 'display_url': display_url,
@@ -301,86 +373,133 @@ async def get_embed_from_message(
     embed.set_footer(text=f"ID: {message.id}")
     embed.timestamp = message.created_at
 
-    return embed, extra_attachments
+    return embed, complete
+
+
+async def shared_members(
+    shared: Optional[dict],
+    user_ids: Iterable[int],
+    guild: discord.Guild
+) -> List[discord.Member]:
+    """get_members, except that members already looked up for
+    another starboard of the same message (kept in `shared`) are
+    reused instead of being requested again"""
+    if shared is None:
+        return await get_members(user_ids, guild)
+    known = shared.setdefault('members', {})
+    user_ids = list(user_ids)
+    missing = [uid for uid in user_ids if uid not in known]
+    if missing:
+        found = {m.id: m for m in await get_members(missing, guild)}
+        for uid in missing:
+            known[uid] = found.get(uid)
+    return [known[uid] for uid in user_ids if known.get(uid) is not None]
 
 
 async def calculate_points(
-    conn: asyncpg.Connection,
     sql_message: dict,
     sql_starboard: dict,
     bot: commands.Bot,
-    guild: discord.Guild
+    guild: discord.Guild,
+    shared: Optional[dict] = None
 ) -> Tuple[int, List[dict]]:
-    get_reactions = \
-        """SELECT * FROM reactions WHERE message_id=$1"""
-    get_user = \
-        """SELECT * FROM users WHERE id=$1"""
-    get_sbemojis = \
-        """SELECT * FROM sbemojis WHERE starboard_id=$1"""
+    """Counts the points of a message on a starboard and saves
+    them. Pass the same `shared` dict when counting a message on
+    several starboards so that members are only looked up once."""
+    # Each user counts once no matter how many of the starboard's
+    # emojis they reacted with. Bots never count, and the author
+    # only counts if selfStar is enabled.
+    get_reactors = \
+        """SELECT DISTINCT reactions.user_id FROM reactions
+        JOIN users ON users.id=reactions.user_id
+        JOIN sbemojis ON sbemojis.name=reactions.name
+        AND sbemojis.starboard_id=$2
+        WHERE reactions.message_id=$1
+        AND users.is_bot=False
+        AND ($3::bool OR reactions.user_id!=$4)"""
     update_message = \
         """UPDATE messages
         SET points=$1
         WHERE orig_message_id=$2
         AND channel_id=$3"""
 
-    message_id = int(sql_message['id'])
+    message_id = sql_message['id']
+    starboard_id = sql_starboard['id']
     self_star = sql_starboard['self_star']
 
-    async with bot.db.lock:
-        async with conn.transaction():
-            emojis = await conn.fetch(get_sbemojis, sql_starboard['id'])
-            all_reactions = await conn.fetch(get_reactions, message_id)
-
-    used_users = set()
-
-    total_points = 0
-    for emoji_obj in emojis:
-        emoji_id = int(emoji_obj['d_id']) if emoji_obj['d_id'] is not None\
-            else None
-        emoji_name = None if emoji_id is not None else emoji_obj['name']
-        reactions = [
-            r for r in all_reactions if r['name']
-            in [str(emoji_id), emoji_name]
-        ]
-        for sql_reaction in reactions:
-            user_id = sql_reaction['user_id']
-            if user_id in used_users:
-                continue
-            used_users.add(user_id)
-            if user_id == sql_message['user_id'] and self_star is False:
-                continue
+    config = await bot.db.config_cache.get(sql_starboard['guild_id'])
+    emojis = config.sbemojis.get(starboard_id, [])
 
-            async with bot.db.lock:
-                async with conn.transaction():
-                    sql_user = await conn.fetchrow(get_user, user_id)
-
-            if sql_user['is_bot'] is True:
-                continue
-
-            member_list = await functions.get_members(
-                [int(sql_user['id'])], guild
+    async with bot.db.acquire() as conn:
+        async with conn.transaction():
+            reactors = await conn.fetch(
+                get_reactors, message_id, starboard_id,
+                self_star, sql_message['user_id']
             )
-            try:
-                member = member_list[0]
-                if member and await functions.is_user_blacklisted(
-                    bot, member, int(sql_starboard['id'])
-                ):
-                    continue
-            except IndexError:
-                pass
 
-            total_points += 1
+    user_ids = [r['user_id'] for r in reactors]
+    total_points = len(user_ids)
+
+    # users who have left the server still count, so only
+    # members that were found can be filtered out
+    if user_ids and config.starboard_filter(starboard_id).has_roles:
+        members = await shared_members(shared, user_ids, guild)
+        total_points -= len(await blacklisted_members(
+            bot, guild, members, starboard_id
+        ))
 
-    async with bot.db.lock:
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             await conn.execute(
                 update_message, total_points,
-                message_id, int(sql_starboard['id'])
+                message_id, starboard_id
             )
+    bot.db.message_links.set_points(message_id, starboard_id, total_points)
 
     return total_points, emojis
 
 
+# {guild_id: (guild.emojis, {emoji_id: emoji})}
+_emoji_maps = {}
+
+
+def guild_emoji_map(
+    guild: discord.Guild
+) -> Dict[int, discord.Emoji]:
+    """Returns {emoji_id: emoji} for the guild's custom emojis.
+    discord.py replaces guild.emojis whenever the emojis change,
+    so the map is rebuilt only then."""
+    entry = _emoji_maps.get(guild.id)
+    if entry is None or entry[0] is not guild.emojis:
+        entry = _emoji_maps[guild.id] = (
+            guild.emojis, {e.id: e for e in guild.emojis}
+        )
+    return entry[1]
+
+
+def resolve_emojis(
+    guild: discord.Guild,
+    names: Iterable[str]
+) -> List[Union[discord.Emoji, str]]:
+    """Turns stored emoji names (the id for custom emojis) into
+    something that can be reacted with. Custom emojis that aren't
+    in the guild anymore are left out."""
+    emoji_map = None
+    emojis = []
+    for name in names:
+        try:
+            emoji_id = int(name)
+        except ValueError:
+            emojis.append(name)
+            continue
+        if emoji_map is None:
+            emoji_map = guild_emoji_map(guild)
+        emoji_obj = emoji_map.get(emoji_id)
+        if emoji_obj is not None:
+            emojis.append(emoji_obj)
+    return emojis
+
+
 async def get_members(
     user_ids: Iterable[int],
     guild: discord.Guild
@@ -394,8 +513,10 @@ async def get_members(
             users.append(u)
         else:
             unfound_ids.append(uid)
-    if unfound_ids != []:
-        users += await guild.query_members(limit=None, user_ids=unfound_ids)
+    # query_members only returns up to 100 members per request
+    for x in range(0, len(unfound_ids), 100):
+        chunk = unfound_ids[x:x+100]
+        users += await guild.query_members(limit=len(chunk), user_ids=chunk)
     return users
 
 
@@ -428,7 +549,10 @@ async def _prefix_callable(
         return commands.when_mentioned_or(
             bot_config.DEFAULT_PREFIX
         )(bot, message)
-    prefixes = await list_prefixes(bot, message.guild.id)
+    prefixes = bot.db.prefixes.matcher(message.guild.id)
+    if prefixes is None:
+        await list_prefixes(bot, message.guild.id)
+        prefixes = bot.db.prefixes.matcher(message.guild.id)
     return commands.when_mentioned_or(*prefixes)(bot, message)
 
 
@@ -447,15 +571,20 @@ async def list_prefixes(
     get_guild = \
         """SELECT * FROM guilds WHERE id=$1"""
 
+    prefixes = bot.db.prefixes.get(guild_id)
+    if prefixes is not None:
+        return list(prefixes)
+
     await check_or_create_existence(
         bot, guild_id=guild_id
     )
 
-    async with bot.db.lock:
-        async with bot.db.conn.transaction():
-            guild = await bot.db.conn.fetchrow(get_guild, guild_id)
+    async with bot.db.acquire() as conn:
+        async with conn.transaction():
+            guild = await conn.fetchrow(get_guild, guild_id)
 
     prefix_list = [p for p in guild['prefixes']]
+    bot.db.prefixes.set(guild_id, prefix_list)
 
     return prefix_list
 
@@ -481,10 +610,11 @@ async def add_prefix(
     await check_or_create_existence(
         bot, guild_id=guild_id
     )
-    async with bot.db.lock:
-        conn = await bot.db.connect()
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             await conn.execute(modify_guild, current_prefixes, guild_id)
+    bot.db.prefixes.set(guild_id, current_prefixes)
+    bot.db.config_cache.invalidate(guild_id)
     return True, ''
 
 
@@ -504,10 +634,11 @@ async def remove_prefix(
         SET prefixes=$1
         WHERE id=$2"""
 
-    async with bot.db.lock:
-        conn = await bot.db.connect()
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             await conn.execute(modify_guild, current_prefixes, guild_id)
+    bot.db.prefixes.set(guild_id, current_prefixes)
+    bot.db.config_cache.invalidate(guild_id)
 
     return True, ''
 
@@ -552,69 +683,109 @@ async def check_or_create_existence(
         """SELECT * FROM starboards WHERE id=$1"""
     check_member = \
         """SELECT * FROM members WHERE user_id=$1 AND guild_id=$2"""
+    # Everything is created in one statement. Skipped parts get
+    # NULL parameters. members relies on the unique
+    # (user_id, guild_id) index for ON CONFLICT.
+    create_all = \
+        """WITH new_guild AS (
+            INSERT INTO guilds (id)
+            SELECT $1 WHERE $1::bigint IS NOT NULL
+            ON CONFLICT DO NOTHING
+            RETURNING id
+        ), new_user AS (
+            INSERT INTO users (id, is_bot)
+            SELECT $2, $3 WHERE $2::bigint IS NOT NULL
+            ON CONFLICT DO NOTHING
+            RETURNING id
+        ), new_member AS (
+            INSERT INTO members (user_id, guild_id)
+            SELECT $2, $1 WHERE $4::bool
+            ON CONFLICT (user_id, guild_id) DO NOTHING
+            RETURNING id
+        ), new_starboard AS (
+            INSERT INTO starboards (id, guild_id)
+            SELECT $5, $1 WHERE $5::bigint IS NOT NULL
+            ON CONFLICT DO NOTHING
+            RETURNING id
+        )
+        SELECT
+            EXISTS (SELECT 1 FROM new_guild) AS new_guild,
+            EXISTS (SELECT 1 FROM new_user) AS new_user,
+            EXISTS (SELECT 1 FROM new_member) AS new_member,
+            EXISTS (SELECT 1 FROM new_starboard) AS new_starboard"""
 
     db = bot.db
-    conn = bot.db.conn
+    known = db.known_rows
 
-    if guild_id is not None:
-        async with bot.db.lock:
+    if user is not None and user_is_id:
+        guild = bot.get_guild(guild_id)
+        users = await functions.get_members([user], guild)
+        user = users[0] if len(users) > 0 else None
+
+    do_guild = guild_id is not None
+    do_user = user is not None
+    do_member = do_member and do_user and do_guild
+    do_starboard = starboard_id is not None and do_guild
+
+    guild_key = ('guild', guild_id)
+    user_key = ('user', user.id) if do_user else None
+    member_key = ('member', user.id, guild_id) if do_member else None
+    starboard_key = ('starboard', starboard_id)
+
+    if not create_new:
+        async with db.acquire() as conn:
             async with conn.transaction():
                 gexists = await check_single_exists(
                     conn, check_guild, [guild_id]
-                )
-                if not gexists and create_new:
-                    await db.q.create_guild.fetch(guild_id)
-    else:
-        gexists = None
-
-    if user is not None:
-        if user_is_id:
-            guild = bot.get_guild(guild_id)
-            users = await functions.get_members([user], guild)
-            if len(users) == 0:
-                uexists = None
-            else:
-                user = users[0]
-                async with bot.db.lock:
-                    async with conn.transaction():
-                        uexists = await check_single_exists(
-                            conn, check_user, [user.id]
-                        )
-                        if not uexists and create_new:
-                            await db.q.create_user.fetch(user.id, user.bot)
-        else:
-            async with bot.db.lock:
-                async with conn.transaction():
-                    uexists = await check_single_exists(
-                        conn, check_user, [user.id]
-                    )
-                    if not uexists and create_new:
-                        await db.q.create_user.fetch(user.id, user.bot)
-    else:
-        uexists = None
-
-    if starboard_id is not None and guild_id is not None:
-        async with bot.db.lock:
-            async with conn.transaction():
+                ) if do_guild else None
+                uexists = await check_single_exists(
+                    conn, check_user, [user.id]
+                ) if do_user else None
                 s_exists = await check_single_exists(
                     conn, check_starboard, [starboard_id]
-                )
-                if not s_exists and create_new:
-                    await db.q.create_starboard.fetch(starboard_id, guild_id)
-    else:
-        s_exists = None
-    if do_member and user is not None and guild_id is not None:
-        async with bot.db.lock:
-            async with conn.transaction():
+                ) if do_starboard else None
                 mexists = await check_single_exists(
                     conn, check_member, [user.id, guild_id]
+                ) if do_member else None
+        return dict(ge=gexists, ue=uexists, se=s_exists, me=mexists)
+
+    need_guild = do_guild and guild_key not in known
+    need_user = do_user and user_key not in known
+    need_member = do_member and member_key not in known
+    need_starboard = do_starboard and starboard_key not in known
+
+    created = {}
+    if need_guild or need_user or need_member or need_starboard:
+        async with db.acquire() as conn:
+            async with conn.transaction():
+                created = await conn.fetchrow(
+                    create_all,
+                    guild_id if do_guild else None,
+                    user.id if do_user else None,
+                    user.bot if do_user else None,
+                    need_member,
+                    starboard_id if need_starboard else None
                 )
-                if not mexists and create_new:
-                    await db.q.create_member.fetch(user.id, guild_id)
-    else:
-        mexists = None
 
-    return dict(ge=gexists, ue=uexists, se=s_exists, me=mexists)
+        if do_guild:
+            known.add(guild_key)
+        if do_user:
+            known.add(user_key)
+        if do_member:
+            known.add(member_key)
+        if do_starboard:
+            known.add(starboard_key)
+
+        if created['new_guild'] or created['new_starboard']:
+            db.config_cache.invalidate(guild_id)
+
+    return dict(
+        ge=not created.get('new_guild', False) if do_guild else None,
+        ue=not created.get('new_user', False) if do_user else None,
+        se=not created.get('new_starboard', False)
+        if do_starboard else None,
+        me=not created.get('new_member', False) if do_member else None
+    )
 
 
 async def handle_role(
@@ -639,14 +810,16 @@ async def set_sb_lock(
     id: int,
     locked: bool
 ) -> None:
-    conn = bot.db.conn
-    async with bot.db.lock:
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
-            await conn.execute(
+            guild_id = await conn.fetchval(
                 """UPDATE starboards
                 SET locked=$1
-                WHERE id=$2""", locked, id
+                WHERE id=$2
+                RETURNING guild_id""", locked, id
             )
+    if guild_id is not None:
+        bot.db.config_cache.invalidate(guild_id)
 
 
 async def set_asc_lock(
@@ -654,14 +827,16 @@ async def set_asc_lock(
     id: int,
     locked: bool
 ) -> None:
-    conn = bot.db.conn
-    async with bot.db.lock:
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
-            await conn.execute(
+            guild_id = await conn.fetchval(
                 """UPDATE aschannels
                 SET locked=$1
-                WHERE id=$2""", locked, id
+                WHERE id=$2
+                RETURNING guild_id""", locked, id
             )
+    if guild_id is not None:
+        bot.db.config_cache.invalidate(guild_id)
 
 
 async def alert_user(
@@ -699,13 +874,11 @@ async def autoredeem(
     one of them does redeem some of their credits
     and alert the user."""
     await bot.wait_until_ready()
-    conn = bot.db.conn
-
     guild = bot.get_guild(guild_id)
     if guild is None:
         return False
 
-    async with bot.db.lock:
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             ar_members = await conn.fetch(
                 """SELECT * FROM members
@@ -715,17 +888,17 @@ async def autoredeem(
             )
     redeemed = False
     for m in ar_members:
-        ms = await get_members([int(m['user_id'])], guild)
+        ms = await get_members([m['user_id']], guild)
         if len(ms) == 0:
             continue
         current_credits = await get_credits(
-            bot, int(m['user_id'])
+            bot, m['user_id']
         )
         if current_credits < bot_config.PREMIUM_COST:
             continue
         try:
             await alert_user(
-                bot, int(m['user_id']),
+                bot, m['user_id'],
                 f"You have autoredeem enabled in {guild.name}, "
                 f"so {bot_config.PREMIUM_COST} credits were taken "
                 "from your account since they ran out of premium."
@@ -734,7 +907,7 @@ async def autoredeem(
             continue
         try:
             await redeem(
-                bot, int(m['user_id']),
+                bot, m['user_id'],
                 guild_id, 1
             )
             redeemed = True
@@ -786,13 +959,12 @@ async def channel_alert(
     aschannels: bool = True
 ) -> None:
     await bot.wait_until_ready()
-    conn = bot.db.conn
     guild = bot.get_guild(int(guild_id))
 
     all_asc = []
     all_sb = []
 
-    async with bot.db.lock:
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             if aschannels:
                 all_asc = await conn.fetch(
@@ -810,13 +982,13 @@ async def channel_alert(
                 )
 
     for ascid in all_asc:
-        c = guild.get_channel(int(ascid['id']))
+        c = guild.get_channel(ascid['id'])
         try:
             await c.send(message)
         except Exception:
             pass
     for sid in all_sb:
-        c = guild.get_channel(int(sid['id']))
+        c = guild.get_channel(sid['id'])
         try:
             await c.send(message)
         except Exception:
@@ -827,9 +999,7 @@ async def remove_all_locks(
     bot: commands.Bot,
     guild_id: int
 ) -> None:  # only to be used by refresh_guild_premium
-    conn = bot.db.conn
-
-    async with bot.db.lock:
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             await conn.execute(
                 """UPDATE starboards
@@ -843,6 +1013,7 @@ async def remove_all_locks(
                 WHERE guild_id=$1""",
                 guild_id
             )
+    bot.db.config_cache.invalidate(guild_id)
 
 
 async def move_starboard_lock(
@@ -850,8 +1021,7 @@ async def move_starboard_lock(
     current_channel: discord.TextChannel,
     new_channel: discord.TextChannel
 ) -> None:
-    conn = bot.db.conn
-    async with bot.db.lock:
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             is_curr_locked = await conn.fetchval(
                 """SELECT locked FROM starboards
@@ -890,8 +1060,7 @@ async def move_aschannel_lock(
     current_channel: discord.TextChannel,
     new_channel: discord.TextChannel
 ) -> None:
-    conn = bot.db.conn
-    async with bot.db.lock:
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             is_curr_locked = await conn.fetchval(
                 """SELECT locked FROM aschannels
@@ -929,10 +1098,8 @@ async def disable_guild_premium(
     bot: commands.Bot,
     guild_id: int
 ) -> None:
-    conn = bot.db.conn
-
     # Get Values
-    async with bot.db.lock:
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             num_starboards = int(await conn.fetchval(
                 """SELECT COUNT(*) FROM starboards
@@ -951,7 +1118,7 @@ async def disable_guild_premium(
 
     # Lock extra starboards
     if sb_to_lock > 0:
-        async with bot.db.lock:
+        async with bot.db.acquire() as conn:
             async with conn.transaction():
                 sb_chosen = await conn.fetch(
                     """SELECT * FROM starboards
@@ -960,11 +1127,11 @@ async def disable_guild_premium(
                     guild_id, sb_to_lock
                 )
         for s in sb_chosen:
-            await set_sb_lock(bot, int(s['id']), True)
+            await set_sb_lock(bot, s['id'], True)
 
     # Lock extra aschannels
     if asc_to_lock > 0:
-        async with bot.db.lock:
+        async with bot.db.acquire() as conn:
             async with conn.transaction():
                 asc_chosen = await conn.fetch(
                     """SELECT * FROM aschannels
@@ -972,7 +1139,7 @@ async def disable_guild_premium(
                     LIMIT $2""", guild_id, asc_to_lock
                 )
         for a in asc_chosen:
-            await set_asc_lock(bot, int(a['id']), True)
+            await set_asc_lock(bot, a['id'], True)
 
 
 async def do_payroll(
@@ -981,13 +1148,12 @@ async def do_payroll(
     get_patrons = \
         """SELECT * FROM users WHERE payment != 0"""
 
-    conn = bot.db.conn
-    async with bot.db.lock:
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             sql_patrons = await conn.fetch(get_patrons)
 
     for sql_user in sql_patrons:
-        user = await bot.fetch_user(int(sql_user['id']))
+        user = await bot.fetch_user(sql_user['id'])
         await givecredits(
             bot, user.id, int(sql_user['payment'])
         )
@@ -1035,8 +1201,7 @@ async def setcredits(
         SET credits=$1
         WHERE id=$2"""
 
-    conn = bot.db.conn
-    async with bot.db.lock:
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             await conn.execute(
                 update_user, credits, user_id
@@ -1053,8 +1218,7 @@ async def get_credits(
     await check_or_create_existence(
         bot, user=user
     )
-    conn = bot.db.conn
-    async with bot.db.lock:
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             sql_user = await conn.fetchrow(
                 get_user, user_id
@@ -1080,8 +1244,7 @@ async def give_months(
         SET premium_end=$1
         WHERE id=$2"""
 
-    conn = bot.db.conn
-    async with bot.db.lock:
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             await conn.execute(modify_guild, new, guild_id)
 
@@ -1107,8 +1270,7 @@ async def is_patron(
     get_user = \
         """SELECT * FROM users WHERE id=$1"""
 
-    conn = bot.db.conn
-    async with bot.db.lock:
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             sql_user = await conn.fetchrow(
                 get_user, user_id
@@ -1124,8 +1286,7 @@ async def get_prem_endsat(
     get_guild = \
         """SELECT * FROM guilds WHERE id=$1"""
 
-    conn = bot.db.conn
-    async with bot.db.lock:
+    async with bot.db.acquire() as conn:
         async with conn.transaction():
             sql_guild = await conn.fetchrow(get_guild, guild_id)
 
@@ -1234,19 +1395,7 @@ async def orig_message_id(
     conn: asyncpg.Connection,
     message_id: int
 ) -> Tuple[int, Optional[int]]:
-    get_message = \
-        """SELECT * FROM messages WHERE id=$1"""
-
-    rows = await conn.fetch(get_message, message_id)
-    if len(rows) == 0:
-        return message_id, None
-    sql_message = rows[0]
-    if sql_message['is_orig'] is True:
-        return message_id, sql_message['channel_id']
-    orig_messsage_id = sql_message['orig_message_id']
-    rows = await conn.fetch(get_message, orig_messsage_id)
-    sql_orig_message = rows[0]
-    return int(orig_messsage_id), int(sql_orig_message['channel_id'])
+    return await db.message_links.resolve(conn, message_id)
 
 
 async def is_user_blacklisted(
@@ -1254,39 +1403,24 @@ async def is_user_blacklisted(
     member: discord.Member,
     starboard_id: int
 ) -> bool:
-    get_blacklisted_roles = \
-        """SELECT * FROM rolebl WHERE starboard_id=$1
-        AND is_whitelist=False"""
-    get_whitelisted_roles = \
-        """SELECT * FROM rolebl WHERE starboard_id=$1
-        AND is_whitelist=True"""
-
-    status = True
-
-    conn = bot.db.conn
-    async with bot.db.lock:
-        async with conn.transaction():
-            sql_rolebl = await conn.fetch(
-                get_blacklisted_roles, starboard_id
-            )
-            sql_rolewl = await conn.fetch(
-                get_whitelisted_roles, starboard_id
-            )
+    config = await bot.db.config_cache.get(member.guild.id)
+    return config.starboard_filter(int(starboard_id)).member_blocked(
+        r.id for r in member.roles
+    )
 
-    rolebl = [int(r['role_id']) for r in sql_rolebl]
-    rolewl = [int(r['role_id']) for r in sql_rolewl]
 
-    if rolebl == [] and rolewl != []:
-        status = False
-    else:
-        for rid in rolebl:
-            if rid in [r.id for r in member.roles]:
-                status = False
-    for rid in rolewl:
-        if rid in [r.id for r in member.roles]:
-            status = True
-
-    return not status
+async def blacklisted_members(
+    bot: commands.Bot,
+    guild: discord.Guild,
+    members: Iterable[discord.Member],
+    starboard_id: int
+) -> List[discord.Member]:
+    """Returns the members in `members` that can't star messages
+    on the starboard because of its role blacklist/whitelist"""
+    config = await bot.db.config_cache.get(guild.id)
+    return config.starboard_filter(int(starboard_id)).blocked_members(
+        members
+    )
 
 
 async def is_message_blacklisted(
@@ -1294,34 +1428,7 @@ async def is_message_blacklisted(
     message: discord.Message,  # assumes that it is the original,
     starboard_id: int
 ) -> bool:
-    get_blacklisted_channels = \
-        """SELECT * FROM channelbl WHERE starboard_id=$1
-        AND is_whitelist=False"""
-    get_whitelisted_channels = \
-        """SELECT * FROM channelbl WHERE starboard_id=$1
-        AND is_whitelist=True"""
-
-    channel_status = True
-
-    conn = bot.db.conn
-    async with bot.db.lock:
-        async with conn.transaction():
-            sql_channelbl = await conn.fetch(
-                get_blacklisted_channels, starboard_id
-            )
-            sql_channelwl = await conn.fetch(
-                get_whitelisted_channels, starboard_id
-            )
-
-    channelbl = [int(c['channel_id']) for c in sql_channelbl]
-    channelwl = [int(c['channel_id']) for c in sql_channelwl]
-
-    # Check channel status
-    if channelwl != []:
-        if message.channel.id not in channelwl:
-            channel_status = False
-    else:
-        if message.channel.id in channelbl:
-            channel_status = False
-
-    return not channel_status  # both must be true
+    config = await bot.db.config_cache.get(message.guild.id)
+    return config.starboard_filter(int(starboard_id)).channel_blocked(
+        message.channel.id
+    )
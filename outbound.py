@@ -0,0 +1,247 @@
+import asyncio
+import traceback
+from collections import Counter, OrderedDict, deque
+from typing import Any, Dict, Iterable, Optional
+
+import discord
+
+import cooldowns
+
+# (rate, per) for each route, per channel. These match the buckets
+# Discord hands out for bots, so staying under them means the
+# library never has to back off on a 429.
+ROUTES = {
+    'post': (5, 5),
+    'delete': (5, 1),
+    'react': (1, 0.25),
+    'edit': (5, 5)
+}
+# queues are served in this order whenever their bucket allows it
+PRIORITY = ('post', 'delete', 'react', 'edit')
+# how long a channel's worker waits for more work before exiting.
+# This is as long as the longest bucket window so that a new burst
+# doesn't start with fresh buckets.
+IDLE_TIMEOUT = max(per for _, per in ROUTES.values())
+
+
+class _ChannelQueue:
+    __slots__ = ('buckets', 'posts', 'deletes', 'reactions', 'edits',
+                 'wakeup', 'task')
+
+    def __init__(self) -> None:
+        self.buckets = {
+            route: cooldowns.Cooldown(rate, per)
+            for route, (rate, per) in ROUTES.items()
+        }
+        # (coroutine function, args, kwargs, future)
+        self.posts: deque = deque()
+        self.deletes: deque = deque()
+        # (message, emoji)
+        self.reactions: deque = deque()
+        # {message id: (message, kwargs)}
+        self.edits: OrderedDict = OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def pending(
+        self,
+        route: str
+    ) -> bool:
+        return bool({
+            'post': self.posts,
+            'delete': self.deletes,
+            'react': self.reactions,
+            'edit': self.edits
+        }[route])
+
+    def __len__(self) -> int:
+        return len(self.posts) + len(self.deletes) + \
+            len(self.reactions) + len(self.edits)
+
+
+class OutboundScheduler:
+    """Sends posts, edits, deletes and reactions to each channel
+    from a single worker, paced against Discord's per-route rate
+    limits.
+
+    New posts are sent before anything else. Edits only hold the
+    latest content for each message: editing a message that already
+    has an edit waiting merges the new fields into it, and the
+    fields are read when the edit is actually sent, so an outdated
+    edit is never sent. Deleting a message drops any edit or
+    reaction still waiting for it."""
+    def __init__(self) -> None:
+        self._channels: Dict[int, _ChannelQueue] = {}
+        self.sent: Counter = Counter()
+        self.coalesced = 0
+        self.cancelled = 0
+        # {(route, exception name): count}
+        self.failures: Counter = Counter()
+
+    def _queue(
+        self,
+        channel_id: int
+    ) -> _ChannelQueue:
+        queue = self._channels.get(channel_id)
+        if queue is None:
+            queue = self._channels[channel_id] = _ChannelQueue()
+        if queue.task is None or queue.task.done():
+            queue.task = asyncio.create_task(self._work(channel_id, queue))
+        queue.wakeup.set()
+        return queue
+
+    async def post(
+        self,
+        channel: discord.abc.Messageable,
+        *args: Any,
+        **kwargs: Any
+    ) -> discord.Message:
+        """Sends a message to `channel` and returns it once sent.
+        Errors are raised here, as if channel.send was called."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue(channel.id).posts.append(
+            (channel.send, args, kwargs, future)
+        )
+        return await future
+
+    def edit(
+        self,
+        message: discord.Message,
+        **kwargs: Any
+    ) -> None:
+        """Edits `message` with `kwargs`, merged into any edit
+        that is still waiting for the same message"""
+        queue = self._queue(message.channel.id)
+        pending = queue.edits.get(message.id)
+        if pending is not None:
+            self.coalesced += 1
+            kwargs = {**pending[1], **kwargs}
+        queue.edits[message.id] = (message, kwargs)
+
+    def delete(
+        self,
+        message: discord.Message
+    ) -> None:
+        queue = self._queue(message.channel.id)
+        if queue.edits.pop(message.id, None) is not None:
+            self.cancelled += 1
+        reactions = [r for r in queue.reactions if r[0].id != message.id]
+        self.cancelled += len(queue.reactions) - len(reactions)
+        queue.reactions = deque(reactions)
+        queue.deletes.append(message)
+
+    def react(
+        self,
+        message: discord.Message,
+        emoji: Any
+    ) -> None:
+        self._queue(message.channel.id).reactions.append((message, emoji))
+
+    def seed_reactions(
+        self,
+        message: discord.Message,
+        emojis: Iterable[Any]
+    ) -> None:
+        """Adds each of `emojis` to `message`, in order, without
+        waiting for them to be added"""
+        queue = self._queue(message.channel.id)
+        queue.reactions.extend((message, emoji) for emoji in emojis)
+
+    async def _send(
+        self,
+        route: str,
+        queue: _ChannelQueue
+    ) -> None:
+        if route == 'post':
+            send, args, kwargs, future = queue.posts.popleft()
+            try:
+                result = await send(*args, **kwargs)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            return
+
+        if route == 'delete':
+            message = queue.deletes.popleft()
+            call = message.delete()
+        elif route == 'react':
+            message, emoji = queue.reactions.popleft()
+            call = message.add_reaction(emoji)
+        else:
+            _, (message, kwargs) = queue.edits.popitem(last=False)
+            call = message.edit(**kwargs)
+        try:
+            await call
+        except Exception as e:
+            # missing messages, emojis or permissions are expected
+            # now and then; anything else is a bug
+            self.failures[route, type(e).__name__] += 1
+            if not isinstance(e, discord.errors.HTTPException):
+                traceback.print_exc()
+
+    async def _work(
+        self,
+        channel_id: int,
+        queue: _ChannelQueue
+    ) -> None:
+        while True:
+            queue.wakeup.clear()
+            if not len(queue):
+                try:
+                    await asyncio.wait_for(
+                        queue.wakeup.wait(), IDLE_TIMEOUT
+                    )
+                except asyncio.TimeoutError:
+                    if not len(queue):
+                        self._channels.pop(channel_id, None)
+                        return
+                continue
+
+            wait = None
+            for route in PRIORITY:
+                if not queue.pending(route):
+                    continue
+                bucket = queue.buckets[route]
+                retry_after = bucket.get_retry_after()
+                if retry_after:
+                    wait = retry_after if wait is None \
+                        else min(wait, retry_after)
+                    continue
+                bucket.update_rate_limit()
+                await self._send(route, queue)
+                self.sent[route] += 1
+                break
+            else:
+                # every route with work is limited; sleep until the
+                # first one frees up or something new is queued
+                try:
+                    await asyncio.wait_for(queue.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    def stop(self) -> None:
+        for queue in self._channels.values():
+            if queue.task is not None:
+                queue.task.cancel()
+            for *_, future in queue.posts:
+                future.cancel()
+        self._channels.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'channels': len(self._channels),
+            'queued': sum(len(q) for q in self._channels.values()),
+            'sent': dict(self.sent),
+            'coalesced': self.coalesced,
+            'cancelled': self.cancelled,
+            'failures': dict(self.failures)
+        }
+
+    def __repr__(self) -> str:
+        return (
+            f"<OutboundScheduler channels: {len(self._channels)} "
+            f"sent: {sum(self.sent.values())}>"
+        )
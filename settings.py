@@ -82,6 +82,8 @@ async def change_starboard_settings(
                     except Exception as e:
                         print(e)
                         status = False
+    if status is True:
+        db.config_cache.invalidate(ssb['guild_id'])
     return status
 
 
@@ -126,6 +128,7 @@ async def change_aschannel_settings(
                 update_aschannel, s['mc'], s['ri'], s['di'],
                 aschannel_id
             )
+    db.config_cache.invalidate(sasc['guild_id'])
 
 
 async def add_aschannel(
@@ -203,6 +206,7 @@ async def add_aschannel(
             await bot.db.q.create_aschannel.fetch(
                 channel.id, guild.id
             )
+    bot.db.config_cache.invalidate(guild.id)
 
 
 async def remove_aschannel(
@@ -230,6 +234,7 @@ async def remove_aschannel(
                 raise errors.DoesNotExist("That is not an AutoStar Channel!")
 
             await conn.execute(del_aschannel, channel_id)
+    bot.db.config_cache.invalidate(guild_id)
 
     await functions.refresh_guild_premium(bot, guild_id, send_alert=False)
 
@@ -265,6 +270,7 @@ async def add_asemoji(
             await bot.db.q.create_asemoji.fetch(
                 aschannel.id, name
             )
+    bot.db.config_cache.invalidate(aschannel.guild.id)
 
 
 async def remove_asemoji(
@@ -300,6 +306,7 @@ async def remove_asemoji(
             await conn.execute(
                 del_asemojis, se['id']
             )
+    bot.db.config_cache.invalidate(aschannel.guild.id)
 
 
 async def add_starboard(
@@ -378,6 +385,7 @@ async def add_starboard(
                 )
 
             await bot.db.q.create_starboard.fetch(channel.id, guild.id)
+    bot.db.config_cache.invalidate(guild.id)
 
     await add_starboard_emoji(bot, channel.id, channel.guild, '⭐')
 
@@ -408,6 +416,8 @@ async def remove_starboard(
             await conn.execute(
                 del_starboard, channel_id
             )
+    bot.db.config_cache.invalidate(guild_id)
+    bot.db.known_rows.discard(('starboard', channel_id))
 
     await functions.refresh_guild_premium(bot, guild_id, send_alert=False)
 
@@ -472,6 +482,7 @@ async def add_starboard_emoji(
             await bot.db.q.create_sbemoji.fetch(
                 emoji_id, starboard_id, emoji_name, False
             )
+    bot.db.config_cache.invalidate(guild.id)
 
 
 async def remove_starboard_emoji(
@@ -513,6 +524,7 @@ async def remove_starboard_emoji(
             await conn.execute(
                 del_sbemoji, emoji_name, starboard_id
             )
+    bot.db.config_cache.invalidate(guild.id)
 
 
 async def add_channel_blacklist(
@@ -550,6 +562,7 @@ async def add_channel_blacklist(
             await bot.db.q.create_channelbl.fetch(
                 starboard_id, channel_id, guild_id, is_whitelist
             )
+    bot.db.config_cache.invalidate(guild_id)
 
 
 async def remove_channel_blacklist(
@@ -576,6 +589,7 @@ async def remove_channel_blacklist(
             await conn.execute(
                 delete_channelbl, channel_id, starboard_id
             )
+    bot.db.config_cache.invalidate(sql_channelbl['guild_id'])
 
 
 async def add_role_blacklist(
@@ -612,6 +626,7 @@ async def add_role_blacklist(
             await bot.db.q.create_rolebl.fetch(
                 starboard_id, role_id, guild_id, is_whitelist
             )
+    bot.db.config_cache.invalidate(guild_id)
 
 
 async def remove_role_blacklist(
@@ -639,3 +654,4 @@ async def remove_role_blacklist(
             await conn.execute(
                 delete_rolebl, role_id, starboard_id
             )
+    bot.db.config_cache.invalidate(sql_rolebl['guild_id'])
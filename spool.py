@@ -0,0 +1,203 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import aiohttp
+import discord
+
+TIMEOUT = aiohttp.ClientTimeout(total=60, connect=5)
+CHUNK_SIZE = 64 * 1024
+
+
+class _Entry:
+    __slots__ = ('path', 'size', 'expires')
+
+    def __init__(
+        self,
+        path: str,
+        size: int,
+        expires: float
+    ) -> None:
+        self.path = path
+        self.size = size
+        self.expires = expires
+
+
+class AttachmentSpool:
+    """Downloads attachments to temporary files so they can be
+    forwarded to starboards without holding them in memory.
+
+    Each attachment is downloaded once, streamed to disk in small
+    chunks, and reused by every starboard it's sent to until it
+    expires. Attachments bigger than `max_file_size`, or that
+    don't fit in `max_size` bytes of spooled files even after the
+    least recently used ones are removed, aren't downloaded at
+    all; get_file returns None and the caller should link to the
+    attachment instead."""
+    def __init__(
+        self,
+        max_file_size: int,
+        max_size: int,
+        ttl: float = 600
+    ) -> None:
+        self.max_file_size = max_file_size
+        self.max_size = max_size
+        self.ttl = ttl
+        self._dir: Optional[str] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        # {attachment_id: _Entry}
+        self._files: OrderedDict = OrderedDict()
+        # {attachment_id: future}, for downloads in progress
+        self._pending: Dict[int, asyncio.Future] = {}
+        # bytes held by downloads in progress
+        self._reserved = 0
+        self._total = 0
+
+        self.hits = 0
+        self.downloads = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def _path(
+        self,
+        attachment_id: int
+    ) -> str:
+        if self._dir is None:
+            self._dir = tempfile.mkdtemp(prefix='starboard-spool-')
+        return os.path.join(self._dir, str(attachment_id))
+
+    def _remove(
+        self,
+        attachment_id: int
+    ) -> None:
+        entry = self._files.pop(attachment_id, None)
+        if entry is None:
+            return
+        self._total -= entry.size
+        # open handles (e.g. a send in progress) keep working
+        # after the file is unlinked
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+    def _make_room(
+        self,
+        size: int
+    ) -> bool:
+        now = time.monotonic()
+        for attachment_id, entry in list(self._files.items()):
+            if entry.expires < now:
+                self._remove(attachment_id)
+        while self._files and \
+                self._total + self._reserved + size > self.max_size:
+            self._remove(next(iter(self._files)))
+        return self._total + self._reserved + size <= self.max_size
+
+    async def get_file(
+        self,
+        attachment: discord.Attachment
+    ) -> Optional[discord.File]:
+        """Returns a discord.File for `attachment`, or None if it
+        is over budget or couldn't be downloaded"""
+        path = await self._spooled(attachment)
+        if path is None:
+            return None
+        return discord.File(
+            path, filename=attachment.filename,
+            spoiler=attachment.is_spoiler()
+        )
+
+    async def _spooled(
+        self,
+        attachment: discord.Attachment
+    ) -> Optional[str]:
+        entry = self._files.get(attachment.id)
+        if entry is not None and entry.expires >= time.monotonic() \
+                and os.path.exists(entry.path):
+            self._files.move_to_end(attachment.id)
+            self.hits += 1
+            return entry.path
+
+        pending = self._pending.get(attachment.id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        self._remove(attachment.id)
+        if attachment.size > self.max_file_size or \
+                not self._make_room(attachment.size):
+            self.skipped += 1
+            return None
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[attachment.id] = future
+        self._reserved += attachment.size
+        path = None
+        try:
+            path = await self._download(attachment)
+        finally:
+            self._reserved -= attachment.size
+            del self._pending[attachment.id]
+            future.set_result(path)
+        return path
+
+    async def _download(
+        self,
+        attachment: discord.Attachment
+    ) -> Optional[str]:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=TIMEOUT)
+        path = self._path(attachment.id)
+        size = 0
+        try:
+            async with self._session.get(attachment.url) as r:
+                if r.status != 200:
+                    raise aiohttp.ClientError(f"status {r.status}")
+                with open(path, 'wb') as f:
+                    async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                        size += len(chunk)
+                        # the reported size was wrong, don't go over
+                        # the budget for it
+                        if size > attachment.size or \
+                                size > self.max_file_size:
+                            raise ValueError("attachment is too large")
+                        f.write(chunk)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError,
+                OSError):
+            self.failed += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        self.downloads += 1
+        self._files[attachment.id] = _Entry(
+            path, size, time.monotonic() + self.ttl
+        )
+        self._total += size
+        return path
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+        self._files.clear()
+        self._total = 0
+
+    def stats(self) -> dict:
+        return {
+            'files': len(self._files),
+            'size': self._total,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'downloads': self.downloads,
+            'skipped': self.skipped,
+            'failed': self.failed
+        }
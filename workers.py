@@ -0,0 +1,217 @@
+import asyncio
+import time
+import traceback
+from collections import Counter, OrderedDict
+from typing import (
+    Any, Awaitable, Callable, Dict, Hashable, List, Optional
+)
+
+
+class WorkerStats:
+    __slots__ = ('processed', 'errors', 'wait', 'run', 'max_wait', 'max_run')
+
+    def __init__(self) -> None:
+        self.processed = 0
+        self.errors = 0
+        self.wait = 0.0
+        self.run = 0.0
+        self.max_wait = 0.0
+        self.max_run = 0.0
+
+    def record(
+        self,
+        wait: float,
+        run: float
+    ) -> None:
+        self.processed += 1
+        self.wait += wait
+        self.run += run
+        self.max_wait = max(self.max_wait, wait)
+        self.max_run = max(self.max_run, run)
+
+
+class WorkerPool:
+    """Runs jobs on a fixed number of workers, each with its own
+    queue.
+
+    A job always goes to the queue picked by hashing its key, so
+    jobs with the same key (e.g. the same message) run one at a
+    time and in the order they were submitted, while jobs with
+    different keys can run on other workers at the same time.
+
+    Each queue holds at most `max_queued` jobs; anything submitted
+    past that is shed. A job can also be dropped as a duplicate if
+    it repeats the latest queued job for the same `dedupe` key.
+    Once `busy_depth` jobs are queued in total the pool counts as
+    busy, and callers can defer work that isn't urgent with
+    defer(). Deferred jobs are only submitted once the pool is no
+    longer busy.
+
+    The workers are started on the first submit, since there may
+    not be a running event loop when the pool is created."""
+    def __init__(
+        self,
+        workers: int,
+        max_queued: int = 0,
+        busy_depth: int = 0,
+        max_deferred: int = 10000
+    ) -> None:
+        self.size = max(1, int(workers))
+        self.max_queued = max_queued
+        self.busy_depth = busy_depth
+        self.max_deferred = max_deferred
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._stats = [WorkerStats() for _ in range(self.size)]
+        # {dedupe key: [state of the latest queued job, jobs queued]}
+        self._pending: Dict[Hashable, list] = {}
+        # {key: (worker key, callback)}
+        self._deferred: OrderedDict = OrderedDict()
+        self.shed: Counter = Counter()
+
+    def __len__(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    @property
+    def busy(self) -> bool:
+        return self.busy_depth > 0 and len(self) >= self.busy_depth
+
+    def _start(self) -> None:
+        self._queues = [
+            asyncio.Queue(self.max_queued) for _ in range(self.size)
+        ]
+        self._tasks = [
+            asyncio.create_task(self._work(x)) for x in range(self.size)
+        ]
+        self._tasks.append(asyncio.create_task(self._drain_deferred()))
+
+    def worker_for(
+        self,
+        key: Hashable
+    ) -> int:
+        return hash(key) % self.size
+
+    def submit(
+        self,
+        key: Hashable,
+        callback: Callable[[], Awaitable[Any]],
+        dedupe: Hashable = None,
+        state: Hashable = None
+    ) -> bool:
+        """Queues a job. Returns False if it was shed, either
+        because the worker's queue is full or because the latest
+        queued job with the same `dedupe` key has the same `state`
+        (e.g. a reaction add that was delivered twice, with no
+        remove in between)."""
+        if not self._tasks:
+            self._start()
+        pending = self._pending.get(dedupe) if dedupe is not None \
+            else None
+        if pending is not None and pending[0] == state:
+            self.shed['duplicate'] += 1
+            return False
+        try:
+            self._queues[self.worker_for(key)].put_nowait(
+                (time.perf_counter(), callback, dedupe)
+            )
+        except asyncio.QueueFull:
+            self.shed['full'] += 1
+            return False
+        if dedupe is not None:
+            if pending is None:
+                self._pending[dedupe] = [state, 1]
+            else:
+                pending[0] = state
+                pending[1] += 1
+        return True
+
+    def defer(
+        self,
+        key: Hashable,
+        callback: Callable[[], Awaitable[Any]],
+        worker_key: Hashable = None
+    ) -> None:
+        """Runs `callback` once the pool isn't busy, on the worker
+        for `worker_key` (or `key`). Deferring the same key again
+        replaces the earlier callback and moves it behind the jobs
+        deferred since. Pass `key=None` for jobs that must all run,
+        in order."""
+        if not self._tasks:
+            self._start()
+        if key is None:
+            key = object()
+        if key in self._deferred:
+            self.shed['coalesced'] += 1
+            self._deferred.move_to_end(key)
+        elif len(self._deferred) >= self.max_deferred:
+            self._deferred.popitem(last=False)
+            self.shed['deferred_dropped'] += 1
+        self._deferred[key] = (
+            worker_key if worker_key is not None else key, callback
+        )
+        self.shed['deferred'] += 1
+
+    async def _drain_deferred(self) -> None:
+        while True:
+            await asyncio.sleep(1)
+            while self._deferred and not self.busy:
+                key, (worker_key, callback) = \
+                    self._deferred.popitem(last=False)
+                if not self.submit(worker_key, callback):
+                    # try again on the next round
+                    self._deferred[key] = (worker_key, callback)
+                    self._deferred.move_to_end(key, last=False)
+                    break
+
+    async def _work(
+        self,
+        x: int
+    ) -> None:
+        queue = self._queues[x]
+        stats = self._stats[x]
+        while True:
+            submitted, callback, dedupe = await queue.get()
+            pending = self._pending.get(dedupe)
+            if pending is not None:
+                pending[1] -= 1
+                if pending[1] == 0:
+                    del self._pending[dedupe]
+            start = time.perf_counter()
+            try:
+                await callback()
+            except Exception:
+                stats.errors += 1
+                traceback.print_exc()
+            finally:
+                stats.record(start - submitted, time.perf_counter() - start)
+                queue.task_done()
+
+    def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._queues = []
+        self._pending.clear()
+        self._deferred.clear()
+
+    def stats(self) -> List[Dict[str, Optional[float]]]:
+        """Returns the queue depth and latency of each worker.
+        Times are in seconds."""
+        result = []
+        for x, s in enumerate(self._stats):
+            result.append({
+                'depth': self._queues[x].qsize() if self._queues else 0,
+                'processed': s.processed,
+                'errors': s.errors,
+                'avg_wait': s.wait/s.processed if s.processed else None,
+                'avg_run': s.run/s.processed if s.processed else None,
+                'max_wait': s.max_wait,
+                'max_run': s.max_run
+            })
+        return result
+
+    def __repr__(self) -> str:
+        return (
+            f"<WorkerPool workers: {self.size} queued: {len(self)} "
+            f"deferred: {len(self._deferred)}>"
+        )